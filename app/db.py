@@ -1,17 +1,143 @@
+import os
+import queue
+import asyncio
 import sqlite3
-from fastapi import Depends
+import threading
+from contextlib import contextmanager
 
 DB_PATH = "database.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# seconds a caller waits for a pooled connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# per-connection pragmas; journal_mode=WAL is persistent and set once in init_db
+PRAGMAS = [
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+]
+
+
+def _connect() -> sqlite3.Connection:
+    # cached_statements keeps the compiled form of each SQL string for re-use
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for p in PRAGMAS:
+        conn.execute(p)
     return conn
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
 
-    conn.executescript("""
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared by all request threads.
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE):
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._overflow: set = set()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return _connect()
+        if _on_event_loop():
+            # blocking here would stop the loop that lets the holders release: use a private connection
+            conn = _connect()
+            self._overflow.add(id(conn))
+            return conn
+        try:
+            return self._idle.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError(f"No database connection free after {DB_POOL_TIMEOUT}s")
+
+    def release(self, conn: sqlite3.Connection):
+        if id(conn) in self._overflow:
+            self._overflow.discard(id(conn))
+            conn.close()
+            return
+        # never hand a half-finished transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+pool = ConnectionPool()
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a pooled connection outside of a request (services, background jobs).
+    """
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+def get_db():
+    """
+    FastAPI dependency: a pooled connection, returned to the pool after the response.
+    """
+    with db_connection() as conn:
+        yield conn
+
+
+def _dedupe_domains(conn: sqlite3.Connection):
+    """
+    Normalize domains and drop repeated rows of the same client so the UNIQUE
+    index can be created. A domain assigned to several clients is not resolved
+    here: the conflicts are listed and the migration fails until an admin
+    removes the wrong assignments.
+    """
+    conn.execute("UPDATE domains SET domain = lower(trim(domain))")
+    conflicts = conn.execute("""
+        SELECT domain, group_concat(id || ':' || client_id, ', ') AS rows
+        FROM domains GROUP BY domain HAVING COUNT(DISTINCT client_id) > 1
+    """).fetchall()
+    if conflicts:
+        for domain, rows in conflicts:
+            print(f"Domain {domain} is assigned to several clients (id:client_id {rows})")
+        raise RuntimeError(f"{len(conflicts)} domain(s) are assigned to more than one client; "
+                           "delete the wrong rows from the domains table and restart")
+    removed = conn.execute("""
+        DELETE FROM domains
+        WHERE id NOT IN (SELECT MIN(id) FROM domains GROUP BY domain)
+    """).rowcount
+    if removed:
+        print(f"Removed {removed} repeated domain row(s)")
+
+# (version, SQL script or callable); applied in order, each in its own transaction
+MIGRATIONS = [
+    (1, """
     CREATE TABLE IF NOT EXISTS admins (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE,
@@ -42,7 +168,44 @@ def init_db():
         domain TEXT,
         FOREIGN KEY(client_id) REFERENCES clients(id)
     );
-    """)
+    """),
+    (2, _dedupe_domains),
+    (3, """
+    CREATE INDEX IF NOT EXISTS idx_domains_client_id ON domains(client_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_domains_domain ON domains(domain);
+    CREATE INDEX IF NOT EXISTS idx_client_users_client_id ON client_users(client_id);
+    """),
+    (4, """
+    CREATE TABLE IF NOT EXISTS auth_revision (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        revision INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO auth_revision (id, revision) VALUES (1, 0);
+    """),
+]
+
+def init_db():
+    conn = _connect()
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute("BEGIN")
+        try:
+            if callable(step):
+                step(conn)
+            else:
+                # executescript would commit the open transaction; run statements one by one
+                for stmt in step.split(";"):
+                    if stmt.strip():
+                        conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"DB migrated to version {target}")
 
-    conn.commit()
     conn.close()
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
 from pydantic import BaseModel
 from app.db import get_db
+from app.services.auth_service import admin_auth, token_cache
+from app.services import pmg_api, pmg_async, pmg_health, pmg_limiter, tracker_store, spam_cache, content_cache
 from app.utils.security import verify_password, generate_token
 
 router = APIRouter()
@@ -9,10 +12,13 @@ class AdminLoginRequest(BaseModel):
     username: str
     password: str
 
-@router.post("/login")
-def admin_login(payload: AdminLoginRequest):
-    db = get_db()
+class QuarantineInvalidateRequest(BaseModel):
+    host: str
+    mailbox: Optional[str] = None
+    ids: Optional[List[str]] = None
 
+@router.post("/login")
+def admin_login(payload: AdminLoginRequest, db=Depends(get_db)):
     row = db.execute(
         "SELECT * FROM admins WHERE username = ?", (payload.username,)
     ).fetchone()
@@ -26,5 +32,60 @@ def admin_login(payload: AdminLoginRequest):
         "UPDATE admins SET token = ? WHERE id = ?", (token, row["id"])
     )
     db.commit()
+    # the previous token stops working right away
+    token_cache.invalidate("admin", admin_id=row["id"])
 
     return {"token": token}
+
+# PMG login hits/misses, to confirm tickets are being re-used
+@router.get("/pmg/stats")
+def pmg_stats(admin=Depends(admin_auth)):
+    return {
+        "sessions": pmg_api.sessions.stats(),
+        "health": pmg_health.snapshot(),
+        "limits": pmg_limiter.snapshot(),
+        "coalescing": pmg_api.flights.stats(),
+        "tracker_density": pmg_api.chunk_density(),
+        "async_clients": pmg_async.stats(),
+        "quarantine_cache": spam_cache.cache.snapshot(),
+        "content_cache": content_cache.stats(),
+    }
+
+# drop released or deleted quarantine messages from the cache before its next revalidation
+@router.post("/quarantine-cache/invalidate")
+async def quarantine_cache_invalidate(payload: QuarantineInvalidateRequest, admin=Depends(admin_auth)):
+    if payload.host not in pmg_api.PMG_HOSTS:
+        raise HTTPException(400, f"Unknown PMG host {payload.host}")
+    mailbox = payload.mailbox.lower() if payload.mailbox else None
+    dropped = await spam_cache.cache.invalidate(pmg_api.canonical_host(payload.host), mailbox, payload.ids)
+    return {"dropped": dropped}
+
+# token cache hit rate for admin_auth / client_auth
+@router.get("/auth/stats")
+def auth_stats(admin=Depends(admin_auth)):
+    return {"token_cache": token_cache.stats()}
+
+# PMG topology as cached by the node cache
+@router.get("/pmg/nodes")
+def pmg_nodes(admin=Depends(admin_auth)):
+    return {"ttl": pmg_api.node_cache.ttl, "hosts": pmg_api.node_cache.snapshot(),
+            "clusters": pmg_api.clusters(), "membership": pmg_api.cluster_map.snapshot()}
+
+# force a /nodes and cluster membership refresh on every host (e.g. after adding a cluster node)
+@router.post("/pmg/nodes/refresh")
+def pmg_nodes_refresh(admin=Depends(admin_auth)):
+    errors = []
+    for host in pmg_api.PMG_HOSTS:
+        try:
+            pmg_api.refresh_cluster(host)
+            pmg_api.refresh_nodes(host)
+        except Exception as e:
+            errors.append({"host": host, "error": str(e)})
+
+    return {"hosts": pmg_api.node_cache.snapshot(), "clusters": pmg_api.clusters(), "errors": errors}
+
+# per-node high-water marks of the local tracker store, and the per-client partitions
+@router.get("/tracker/sync")
+def tracker_sync_status(admin=Depends(admin_auth)):
+    return {"enabled": tracker_store.TRACKER_SYNC_ENABLED, "nodes": tracker_store.sync_status(),
+            "partitions": tracker_store.partition_status()}
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Header, HTTPException
-from app.db import get_db
+from app.services.auth_service import lookup_client_token
 
 router = APIRouter()
 
@@ -8,10 +8,9 @@ def validate_client(token: str = Header(None)):
     if not token:
         raise HTTPException(401, "Missing token")
 
-    db = get_db()
-    row = db.execute("SELECT id, client_id FROM client_users WHERE token = ?", (token,)).fetchone()
+    identity = lookup_client_token(token)
 
-    if not row:
+    if not identity:
         raise HTTPException(403, "Invalid token")
 
-    return {"user_id": row["id"], "client_id": row["client_id"]}
+    return {"user_id": identity["user_id"], "client_id": identity["client_id"]}
@@ -0,0 +1,77 @@
+# app/routers/bulk.py
+import io
+import csv
+import sqlite3
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+from app.db import get_db
+from app.services.auth_service import admin_auth
+from app.services import provisioning
+from starlette.concurrency import run_in_threadpool
+
+router = APIRouter()
+
+# fields are optional here so bad rows end up in the per-row report instead of failing the request
+class BulkClient(BaseModel):
+    name: Optional[str] = None
+
+class BulkUser(BaseModel):
+    client_id: Optional[int] = None
+    client: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
+
+class BulkDomain(BaseModel):
+    client_id: Optional[int] = None
+    client: Optional[str] = None
+    domain: Optional[str] = None
+
+class BulkImportRequest(BaseModel):
+    clients: List[BulkClient] = Field(default_factory=list, max_length=provisioning.BULK_MAX_ROWS)
+    users: List[BulkUser] = Field(default_factory=list, max_length=provisioning.BULK_MAX_ROWS)
+    domains: List[BulkDomain] = Field(default_factory=list, max_length=provisioning.BULK_MAX_ROWS)
+    all_or_nothing: bool = False
+    dry_run: bool = False
+
+def _run(db, clients, users, domains, all_or_nothing, dry_run):
+    try:
+        return provisioning.provision(db, clients, users, domains, all_or_nothing=all_or_nothing, dry_run=dry_run)
+    except sqlite3.IntegrityError as e:
+        # a concurrent change won the race after validation; the transaction was rolled back
+        raise HTTPException(409, f"Import conflicts with existing data, nothing was imported: {e}")
+
+@router.post("/import")
+def bulk_import(payload: BulkImportRequest, admin=Depends(admin_auth), db=Depends(get_db)):
+    """
+    Create clients, users and domains in one transaction. Users and domains
+    refer to their client by client_id or by name (also clients from this import).
+    Returns one report row per input row; user rows carry the new token.
+    """
+    return _run(db,
+                [c.model_dump() for c in payload.clients],
+                [u.model_dump() for u in payload.users],
+                [d.model_dump() for d in payload.domains],
+                payload.all_or_nothing, payload.dry_run)
+
+@router.post("/import/csv")
+async def bulk_import_csv(
+    request: Request,
+    kind: str = Query(..., pattern="^(clients|users|domains)$"),
+    all_or_nothing: bool = Query(False),
+    dry_run: bool = Query(False),
+    admin=Depends(admin_auth),
+    db=Depends(get_db)):
+    """
+    CSV body with a header row:
+    clients: name / users: client_id or client, username, password / domains: client_id or client, domain.
+    """
+    text = (await request.body()).decode("utf-8-sig")
+    rows = list(csv.DictReader(io.StringIO(text)))
+    if len(rows) > provisioning.BULK_MAX_ROWS:
+        raise HTTPException(413, f"At most {provisioning.BULK_MAX_ROWS} rows per import")
+
+    tables = {"clients": [], "users": [], "domains": []}
+    tables[kind] = rows
+    return await run_in_threadpool(_run, db, tables["clients"], tables["users"], tables["domains"],
+                                   all_or_nothing, dry_run)
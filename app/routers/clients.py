@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from app.services.auth_service import admin_auth
+from app.services.auth_service import admin_auth, token_cache
 from app.utils.security import hash_password, generate_token
 from app.db import get_db
+from app.services.client_domains import invalidate_client
 
 router = APIRouter()
 
@@ -12,9 +13,7 @@ class CreateClientRequest(BaseModel):
 #here a client is created by admin
 
 @router.post("/create")
-def create_client(payload: CreateClientRequest, admin=Depends(admin_auth)):
-    db = get_db()
-
+def create_client(payload: CreateClientRequest, admin=Depends(admin_auth), db=Depends(get_db)):
     try:
         db.execute("INSERT INTO clients (name) VALUES (?)", (payload.name,))
         db.commit()
@@ -30,9 +29,7 @@ class CreateClientUserRequest(BaseModel):
     password: str
 
 @router.delete("/delete/{client_id}")
-def delete_client(client_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def delete_client(client_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     # ensure client exists
     cur = db.execute("SELECT id FROM clients WHERE id = ?", (client_id,))
     if cur.fetchone() is None:
@@ -43,15 +40,15 @@ def delete_client(client_id: int, admin=Depends(admin_auth)):
     db.execute("DELETE FROM domains WHERE client_id = ?", (client_id,))
     db.execute("DELETE FROM clients WHERE id = ?", (client_id,))
     db.commit()
+    invalidate_client(client_id)
+    token_cache.invalidate("client", client_id=client_id)
 
     return {"status": "client_deleted", "client_id": client_id}
 
 
 #client user against a client is created by admin and a token is generated for that user
 @router.post("/create-user")
-def create_client_user(payload: CreateClientUserRequest, admin=Depends(admin_auth)):
-    db = get_db()
-
+def create_client_user(payload: CreateClientUserRequest, admin=Depends(admin_auth), db=Depends(get_db)):
     hashed = hash_password(payload.password)
     token = generate_token()
 
@@ -67,9 +64,7 @@ def create_client_user(payload: CreateClientUserRequest, admin=Depends(admin_aut
     return {"status": "user_created", "token": token}
 
 @router.delete("/delete-user/{user_id}")
-def delete_client_user(user_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def delete_client_user(user_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     cur = db.execute("SELECT id FROM client_users WHERE id = ?", (user_id,))
     row = cur.fetchone()
 
@@ -79,6 +74,7 @@ def delete_client_user(user_id: int, admin=Depends(admin_auth)):
     try:
         db.execute("DELETE FROM client_users WHERE id = ?", (user_id,))
         db.commit()
+        token_cache.invalidate("client", user_id=user_id)
 
     except Exception as e:
         print("REAL ERROR:", e)
@@ -93,8 +89,7 @@ def delete_client_user(user_id: int, admin=Depends(admin_auth)):
 
 # Get all clients
 @router.get("/get-all")
-def get_all_clients(admin=Depends(admin_auth)):
-    db = get_db()
+def get_all_clients(admin=Depends(admin_auth), db=Depends(get_db)):
     rows = db.execute("SELECT id, name, created_at FROM clients").fetchall()
 
     return {"clients": [dict(r) for r in rows]}
@@ -102,9 +97,7 @@ def get_all_clients(admin=Depends(admin_auth)):
 
 # Get a single client and all its related data
 @router.get("/get/{client_id}")
-def get_client(client_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def get_client(client_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     # fetch client
     c = db.execute("SELECT id, name, created_at FROM clients WHERE id = ?", (client_id,)).fetchone()
     if c is None:
@@ -129,9 +122,7 @@ def get_client(client_id: int, admin=Depends(admin_auth)):
 
 # Get all users under a specific client
 @router.get("/users/{client_id}")
-def get_client_users(client_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def get_client_users(client_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     rows = db.execute("""
         SELECT id, username, role, created_at,token
         FROM client_users 
@@ -143,9 +134,7 @@ def get_client_users(client_id: int, admin=Depends(admin_auth)):
 
 # Get a single user by ID
 @router.get("/user/{user_id}")
-def get_single_user(user_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def get_single_user(user_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     row = db.execute("""
         SELECT id, client_id, username, role, created_at,token
         FROM client_users 
@@ -1,84 +1,135 @@
 # app/routers/domain_filter.py
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from app.services.auth_service import client_auth
-from app.db import get_db
-from app.services import pmg_api
+from app.services import pmg_api, pmg_async, tracker_store
+from app.services.client_domains import get_matcher_for_client
+from app.services.domain_matcher import DomainMatcher
+from starlette.concurrency import run_in_threadpool
+from app.utils.streaming import wants_ndjson, ndjson_response
+from app.utils.responses import json_response
 from typing import List
+import time
 
 router = APIRouter()
 
-def _matches_receiving_domain(item: dict, domains_set: set) -> bool:
+RECEIVING_KEYS = ["to", "recipient", "rcpt_to", "receiver_address"]
+
+def _matches_receiving_domain(item: dict, matcher: DomainMatcher) -> bool:
+    """
+    Only match if the receiving address (to, recipient, rcpt_to, etc.) matches the client's domains
+    """
+    return matcher.match_item(item, RECEIVING_KEYS)
+
+def _filters(matcher: DomainMatcher, match: bool):
+    # only the client's own receivers can be asked for; the blocklist needs the full scan
+    return pmg_api.plan_filters(matcher, "target") if match else None
+
+def _uid(it: dict):
+    return it.get("id") or it.get("message_id") or f"{it.get('from')}_{it.get('to')}_{it.get('time', it.get('timestamp',''))}_{it.get('subject','')}"
+
+def _today() -> tuple:
+    # PMG's tracker defaults to the current day when no window is given
+    now = int(time.time())
+    lt = time.localtime(now)
+    midnight = int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)))
+    return midnight, now
+
+def _newest(items: List[dict], limit: int, keep) -> List[dict]:
+    """
+    The newest `limit` items that pass keep(), each once: the cut the store applies in SQL.
+    """
+    out, seen = [], set()
+    for it in sorted(items, key=lambda it: it.get("time") or 0, reverse=True):
+        if not keep(it):
+            continue
+        uid = _uid(it)
+        if uid in seen:
+            continue
+        seen.add(uid)
+        out.append(it)
+        if len(out) >= limit:
+            break
+    return out
+
+async def _fetch_items(limit: int, matcher: DomainMatcher, match: bool, client_id: int, keep) -> tuple:
     """
-    Only match if the receiving address (to, recipient, rcpt_to, etc.) matches domains_set
+    Today's newest `limit` tracker entries passing keep(), from the local store when it
+    is in sync (the client's own partition for the whitelist), else from all nodes.
+    Returns (items, errors); errors lists hosts/nodes that were skipped or failed.
     """
-    receiving_keys = ["to", "recipient", "rcpt_to", "receiver_address"]
-    for k in receiving_keys:
-        v = item.get(k)
-        if v and isinstance(v, str) and v.lower().split("@")[-1] in domains_set:
-            return True
-    return False
+    midnight, now = _today()
+    if await run_in_threadpool(tracker_store.covers, midnight, now):
+        items = await run_in_threadpool(tracker_store.query_receiving, midnight, now, matcher, match, limit, client_id)
+        return _newest(items, limit, keep), []
+    # no per-node limit: `limit` counts entries across all nodes, like on the store path
+    items, errors = await pmg_async.fetch_all_tracker(params={"starttime": midnight, "endtime": now},
+                                                      filters=_filters(matcher, match))
+    return _newest(items, limit, keep), errors
+
+async def _iter_items(limit: int, matcher: DomainMatcher, match: bool, client_id: int, keep):
+    """
+    Streaming counterpart of _fetch_items. Node errors stream as they happen; the
+    entries follow in one batch once every node answered, since the newest `limit`
+    are only known then.
+    """
+    midnight, now = _today()
+    if await run_in_threadpool(tracker_store.covers, midnight, now):
+        items = await run_in_threadpool(tracker_store.query_receiving, midnight, now, matcher, match, limit, client_id)
+        yield None, None, _newest(items, limit, keep), None
+        return
+    items = []
+    async for host, node, batch, error in pmg_async.iter_tracker_batches(params={"starttime": midnight, "endtime": now},
+                                                                         filters=_filters(matcher, match)):
+        if error is not None:
+            yield host, node, [], error
+        items.extend(batch)
+    yield None, None, _newest(items, limit, keep), None
 
 @router.get("/blocklist")
-def filter_blocklist(limit: int = Query(500, le=5000), user=Depends(client_auth)):
+async def filter_blocklist(request: Request, limit: int = Query(500, le=5000), user=Depends(client_auth)):
     """
-    Returns tracker entries NOT belonging to the client's assigned domains (blocked domains)
+    Returns today's newest `limit` tracker entries NOT belonging to the client's assigned domains (blocked domains)
+    Streams NDJSON when requested with "Accept: application/x-ndjson".
     """
     client_id = user["client_id"]
-    db = get_db()
-    rows = db.execute("SELECT domain FROM domains WHERE client_id = ?", (client_id,)).fetchall()
-    client_domains = set(r["domain"].lower() for r in rows)
+    client_domains = await run_in_threadpool(get_matcher_for_client, client_id)
     if not client_domains:
         raise HTTPException(status_code=404, detail="No domains assigned to this client")
 
+    # filter out items matching client's domains
+    keep = lambda it: not _matches_receiving_domain(it, client_domains)
+
+    if wants_ndjson(request):
+        return ndjson_response(_iter_items(limit, client_domains, False, client_id, keep), keep=keep, uid=_uid)
+
     try:
-        items = pmg_api.get_all_tracker(params={"limit": limit}, limit_per_node=limit)
+        items, errors = await _fetch_items(limit, client_domains, False, client_id, keep)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"PMG API error: {e}")
 
-    # filter out items matching client's domains
-    filtered = [it for it in items if not _matches_receiving_domain(it, client_domains)]
-
-    # dedupe
-    seen = set()
-    deduped = []
-    for it in filtered:
-        uid = it.get("id") or it.get("message_id") or f"{it.get('from')}_{it.get('to')}_{it.get('time', it.get('timestamp',''))}_{it.get('subject','')}"
-        if uid in seen:
-            continue
-        seen.add(uid)
-        deduped.append(it)
-
-    return {"count": len(deduped), "items": deduped}
+    return json_response({"count": len(items), "items": items, "partial": bool(errors), "errors": errors})
 
 
 @router.get("/whitelist")
-def filter_whitelist(limit: int = Query(500, le=5000), user=Depends(client_auth)):
+async def filter_whitelist(request: Request, limit: int = Query(500, le=5000), user=Depends(client_auth)):
     """
-    Returns tracker entries ONLY belonging to the client's assigned domains (whitelisted domains)
+    Returns today's newest `limit` tracker entries ONLY belonging to the client's assigned domains (whitelisted domains)
+    Streams NDJSON when requested with "Accept: application/x-ndjson".
     """
     client_id = user["client_id"]
-    db = get_db()
-    rows = db.execute("SELECT domain FROM domains WHERE client_id = ?", (client_id,)).fetchall()
-    client_domains = set(r["domain"].lower() for r in rows)
+    client_domains = await run_in_threadpool(get_matcher_for_client, client_id)
     if not client_domains:
         raise HTTPException(status_code=404, detail="No domains assigned to this client")
 
+    # keep only items matching client's domains
+    keep = lambda it: _matches_receiving_domain(it, client_domains)
+
+    if wants_ndjson(request):
+        return ndjson_response(_iter_items(limit, client_domains, True, client_id, keep), keep=keep, uid=_uid)
+
     try:
-        items = pmg_api.get_all_tracker(params={"limit": limit}, limit_per_node=limit)
+        items, errors = await _fetch_items(limit, client_domains, True, client_id, keep)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"PMG API error: {e}")
 
-    # keep only items matching client's domains
-    filtered = [it for it in items if _matches_receiving_domain(it, client_domains)]
-
-    # dedupe
-    seen = set()
-    deduped = []
-    for it in filtered:
-        uid = it.get("id") or it.get("message_id") or f"{it.get('from')}_{it.get('to')}_{it.get('time', it.get('timestamp',''))}_{it.get('subject','')}"
-        if uid in seen:
-            continue
-        seen.add(uid)
-        deduped.append(it)
-
-    return {"count": len(deduped), "items": deduped}
+    return json_response({"count": len(items), "items": items, "partial": bool(errors), "errors": errors})
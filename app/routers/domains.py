@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app.services.auth_service import admin_auth
 from app.db import get_db
+from app.services.client_domains import invalidate_client
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -9,8 +10,7 @@ class DomainCreate(BaseModel):
     domain: str
 
 @router.post("/{client_id}/domains")
-def add_domain(client_id: int, payload: DomainCreate, admin=Depends(admin_auth)):
-    db = get_db()
+def add_domain(client_id: int, payload: DomainCreate, admin=Depends(admin_auth), db=Depends(get_db)):
     domain = payload.domain.strip().lower()
     
     if not domain:
@@ -33,15 +33,14 @@ def add_domain(client_id: int, payload: DomainCreate, admin=Depends(admin_auth))
             (client_id, domain)
         )
         db.commit()
+        invalidate_client(client_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Domain already exists or DB error")
 
     return {"status": "domain_added", "client_id": client_id, "domain": domain}
 
 @router.get("/{client_id}/domains")
-def get_domains(client_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def get_domains(client_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     # validate client exists
     r = db.execute(
         "SELECT id FROM clients WHERE id = ?",
@@ -70,9 +69,7 @@ def get_domains(client_id: int, admin=Depends(admin_auth)):
 # NEW: DELETE ROUTE — DELETE SPECIFIC DOMAIN
 # -------------------------------
 @router.delete("/{client_id}/domains/{domain_id}")
-def delete_domain(client_id: int, domain_id: int, admin=Depends(admin_auth)):
-    db = get_db()
-
+def delete_domain(client_id: int, domain_id: int, admin=Depends(admin_auth), db=Depends(get_db)):
     # validate domain exists and belongs to client
     r = db.execute(
         "SELECT id FROM domains WHERE id = ? AND client_id = ?",
@@ -88,6 +85,7 @@ def delete_domain(client_id: int, domain_id: int, admin=Depends(admin_auth)):
             (domain_id, client_id)
         )
         db.commit()
+        invalidate_client(client_id)
     except Exception as e:
         print("REAL ERROR:", e)
         raise HTTPException(400, "Error deleting domain")
@@ -0,0 +1,83 @@
+# app/routers/jobs.py
+import os
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from app.services.auth_service import client_auth
+from app.services import query_jobs
+from app.services.client_domains import get_matcher_for_client
+from app.routers.tracker import tracking_job
+from app.routers.spam_quarantine import quarantine_job
+from starlette.concurrency import run_in_threadpool
+from app.utils.streaming import NDJSON
+
+router = APIRouter()
+
+RUNNERS = {
+    "tracking": tracking_job,
+    "spam_quarantine": quarantine_job,
+}
+
+class JobRequest(BaseModel):
+    kind: Literal["tracking", "spam_quarantine"]
+    starttime: int = Field(..., ge=0)
+    endtime: int = Field(..., ge=0)
+
+async def _job_or_404(job_id: str, client_id: int) -> dict:
+    job = await run_in_threadpool(query_jobs.get, job_id, client_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("", status_code=202)
+async def submit_job(payload: JobRequest, user=Depends(client_auth)):
+    """
+    Run a long tracker or quarantine query in the background and return its job.
+    Poll GET /jobs/{id} for progress (nodes or mailboxes done) and fetch
+    GET /jobs/{id}/result once it is "done". An identical job that is still
+    running or finished recently is returned ("reused": true) instead of a new one.
+    """
+    client_id = user["client_id"]
+    if payload.endtime < payload.starttime:
+        raise HTTPException(status_code=400, detail="endtime must not be before starttime")
+    if not await run_in_threadpool(get_matcher_for_client, client_id):
+        raise HTTPException(status_code=404, detail="No domains assigned to this client")
+
+    params = {"starttime": payload.starttime, "endtime": payload.endtime}
+    try:
+        job, reused = await query_jobs.submit(client_id, payload.kind, params, RUNNERS[payload.kind])
+    except query_jobs.JobQuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {**job, "reused": reused}
+
+@router.get("")
+async def list_jobs(user=Depends(client_auth)):
+    jobs = await run_in_threadpool(query_jobs.list_jobs, user["client_id"])
+    return {"count": len(jobs), "items": jobs}
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, user=Depends(client_auth)):
+    return await _job_or_404(job_id, user["client_id"])
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, user=Depends(client_auth)):
+    """
+    The spooled result as NDJSON: one row per line, then a {"_summary": {...}} line.
+    """
+    job = await _job_or_404(job_id, user["client_id"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    path = query_jobs.result_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Result has expired")
+    return FileResponse(path, media_type=NDJSON, filename=f"{job['kind']}-{job_id}.ndjson")
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str, user=Depends(client_auth)):
+    job = await _job_or_404(job_id, user["client_id"])
+    if job["status"] not in query_jobs.ACTIVE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if not query_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is running in another worker process")
+    return {"id": job_id, "status": "cancelling"}
@@ -1,45 +1,129 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import codecs
+import json
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from app.services.auth_service import client_auth
-from app.services import pmg_api
+from app.services import pmg_api, pmg_async, pmg_health, content_cache
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 router = APIRouter()
 
+def _json_stream(id: str, host: str, chunks):
+    """
+    Encode {"id", "host", "content"} on the fly so the body is never held as one string.
+    """
+    async def body():
+        yield json.dumps({"id": id, "host": host})[:-1] + ', "content": "'
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield json.dumps(text)[1:-1]
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield json.dumps(tail)[1:-1]
+        yield '"}'
+    return body()
+
+async def _replay(chunks):
+    for chunk in chunks:
+        yield chunk
+
 @router.get("/spam-content")
-def spam_content(
+async def spam_content(
+    request: Request,
     id: str = Query(..., description="Content ID of the quarantined mail"),
     host: str = Query(..., description="PMG host to query"),
+    raw: bool = Query(False, description="Return text/html instead of a JSON envelope"),
     user=Depends(client_auth)
 ):
     """
     Fetch the full HTML content of a single spam email from PMG.
     The PMG endpoint returns raw HTML, not JSON.
+    Bodies are cached on disk (gzip, content-addressed) and revalidated with ETag /
+    If-None-Match. A miss of up to PMG_STREAM_BUFFER bytes is read in full and
+    cached first, so it carries its ETag too; larger misses are streamed through
+    while being cached and get theirs from the next request on.
     """
-    try:
-        # Login to PMG host
-        sess_info = pmg_api.login_and_get_session(host)
-        session = sess_info["session"]
-        csrf = sess_info.get("csrf")
+    if host not in pmg_api.PMG_HOSTS:
+        raise HTTPException(status_code=400, detail=f"Unknown PMG host {host}")
 
-        headers = {}
-        if csrf:
-            headers["CSRFPreventionToken"] = csrf
-
-        # Request the raw HTML content
-        resp = session.get(
-            f"https://{host}/api2/htmlmail/quarantine/content",
-            params={"id": id},
-            headers=headers,
-            timeout=pmg_api.REQUEST_TIMEOUT,
-            verify=pmg_api.PMG_VERIFY_SSL
-        )
+    media_type = "text/html; charset=utf-8" if raw else "application/json"
+
+    digest = await run_in_threadpool(content_cache.etag, host, id)
+    if digest:
+        headers = {"ETag": f'"{digest}"'}
+        if request.headers.get("if-none-match", "").strip() in (f'"{digest}"', f'W/"{digest}"', "*"):
+            return Response(status_code=304, headers=headers)
+        chunks = iterate_in_threadpool(content_cache.iter_content(digest))
+        body = chunks if raw else _json_stream(id, host, chunks)
+        return StreamingResponse(body, media_type=media_type, headers=headers)
+
+    stack = AsyncExitStack()
+    try:
+        # Request the raw HTML content over the pooled async client, without buffering it
+        resp = await stack.enter_async_context(pmg_async.client(host).stream(
+            "GET", "htmlmail/quarantine/content",
+            params={"id": id}
+        ))
         resp.raise_for_status()
 
-        # Return the raw HTML
-        content = resp.text
-        if not content:
+        upstream = resp.aiter_bytes(content_cache.CHUNK_SIZE)
+        first = b""
+        async for first in upstream:
+            if first:
+                break
+        if not first:
             raise HTTPException(status_code=404, detail=f"No content found for id {id}")
 
-        return {"id": id, "host": host, "content": content}
-
+        # pmg_async has buffered bodies this small already, so reading on costs no upstream wait
+        head, size, complete = [first], len(first), False
+        while not complete and size <= pmg_async.PMG_STREAM_BUFFER:
+            chunk = await anext(upstream, None)
+            if chunk is None:
+                complete = True
+            elif chunk:
+                head.append(chunk)
+                size += len(chunk)
+    except HTTPException:
+        await stack.aclose()
+        raise
+    except pmg_health.HostUnavailable as e:
+        await stack.aclose()
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
+        await stack.aclose()
         raise HTTPException(status_code=500, detail=f"Error fetching content for id {id} on host {host}: {e}")
+
+    if complete:
+        await stack.aclose()
+        headers = {}
+        try:
+            digest = await run_in_threadpool(content_cache.put, host, id, head)
+            headers["ETag"] = f'"{digest}"'
+        except Exception as e:
+            print(f"Content cache write failed for id {id} on host {host}: {e}")
+        body = _replay(head) if raw else _json_stream(id, host, _replay(head))
+        return StreamingResponse(body, media_type=media_type, headers=headers)
+
+    async def tee():
+        # compression, fsync/rename and eviction stay off the event loop
+        writer = await run_in_threadpool(content_cache.Writer, host, id)
+        complete = False
+        try:
+            for chunk in head:
+                await run_in_threadpool(writer.write, chunk)
+                yield chunk
+            async for chunk in upstream:
+                await run_in_threadpool(writer.write, chunk)
+                yield chunk
+            complete = True
+        finally:
+            try:
+                await run_in_threadpool(writer.commit if complete else writer.discard)
+            finally:
+                await stack.aclose()
+
+    body = tee() if raw else _json_stream(id, host, tee())
+    return StreamingResponse(body, media_type=media_type)
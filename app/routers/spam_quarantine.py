@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends
 from app.services.auth_service import client_auth
 from app.services import pmg_spam
+from app.utils.cursor import encode_cursor, decode_cursor, position
+from app.utils.responses import json_response
 from typing import Optional
 from fastapi import Query
 import time
@@ -21,11 +23,13 @@ router = APIRouter()
 #     return {"count": len(items), "items": items}
 
 @router.get("/spam-quarantine")
-def spam_quarantine(
+async def spam_quarantine(
     user=Depends(client_auth),
     starttime: Optional[int] = Query(None, description="Unix epoch start time for spam query", ge=0),
     endtime: Optional[int] = Query(None, description="Unix epoch end time for spam query", ge=0),
-    limit: Optional[int] = Query(500, description="Max number of spam messages to return", ge=1)
+    limit: Optional[int] = Query(500, description="Max number of spam messages to return", ge=1),
+    page_size: Optional[int] = Query(None, ge=1, le=5000, description="Return one page of this size"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page")
 ):
     client_id = user["client_id"]
     now = int(time.time())
@@ -36,10 +40,32 @@ def spam_quarantine(
     if endtime is None:
         endtime = now
 
-    items = pmg_spam.get_spam_quarantine(client_id=client_id, starttime=starttime, endtime=endtime)
+    # hosts that were skipped or failed; the response is marked partial
+    errors = []
+
+    if page_size or cursor:
+        page_size = page_size or 50
+        items = await pmg_spam.get_spam_page(client_id, starttime, endtime, page_size,
+                                             after=decode_cursor(cursor), errors=errors)
+        next_cursor = encode_cursor(position(items[-1], node_key="_pmg_node")) if len(items) == page_size else None
+        return json_response({"count": len(items), "items": items, "next_cursor": next_cursor,
+                              "partial": bool(errors), "errors": errors})
+
+    # newest `limit` messages across all mailboxes and clusters
+    items = await pmg_spam.get_spam_quarantine(client_id=client_id, starttime=starttime, endtime=endtime,
+                                               limit=limit, errors=errors)
 
     if limit:
         items = items[:limit]
 
-    return {"count": len(items), "items": items}
+    return json_response({"count": len(items), "items": items, "partial": bool(errors), "errors": errors})
+
+
 
+async def quarantine_job(client_id: int, params: dict, progress, errors: list):
+    """
+    Body of a "spam_quarantine" query job (/jobs): the client's whole quarantine
+    for the window, newest first, without the request's limit.
+    """
+    yield await pmg_spam.get_spam_quarantine(client_id=client_id, starttime=params["starttime"],
+                                             endtime=params["endtime"], errors=errors, progress=progress)
@@ -0,0 +1,99 @@
+# app/routers/stats.py
+import time
+from collections import Counter
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.services.auth_service import client_auth
+from app.services import pmg_spam, spam_stats, tracker_store
+from app.services.client_domains import get_matcher_for_client
+from starlette.concurrency import run_in_threadpool
+from app.utils.responses import json_response
+
+router = APIRouter()
+
+DAY = 86400
+
+def _group_key(row: dict, group_by: str):
+    if group_by == "day":
+        return row["bucket"] // DAY * DAY
+    if group_by == "hour":
+        return row["bucket"] // 3600 * 3600
+    return row[group_by]
+
+def _groups(rows: list, group_by: str) -> list:
+    counts = Counter()
+    for r in rows:
+        counts[_group_key(r, group_by)] += r["count"]
+    if group_by in ("day", "hour"):
+        # time series in time order
+        ordered = sorted(counts.items())
+    else:
+        # largest first
+        ordered = sorted(counts.items(), key=lambda kv: (-kv[1], str(kv[0])))
+    return [{"key": k, "count": c} for k, c in ordered]
+
+def _window(starttime: Optional[int], endtime: Optional[int]) -> tuple:
+    now = int(time.time())
+    return (now - 7 * DAY if starttime is None else starttime), (now if endtime is None else endtime)
+
+@router.get("/quarantine")
+async def quarantine_stats(
+    starttime: Optional[int] = Query(None, ge=0, description="Unix start time (default: 7 days ago)"),
+    endtime: Optional[int] = Query(None, ge=0, description="Unix end time (default: now)"),
+    group_by: str = Query("domain", pattern="^(domain|mailbox|day|hour)$"),
+    refresh: bool = Query(True, description="Pull new quarantine entries before reading the rollup"),
+    user=Depends(client_auth)):
+    """
+    Spam counts for the client's domains grouped by domain, mailbox, day or hour,
+    plus a histogram of spam scores. Read from the spam_rollup buckets; with
+    refresh, the quarantine cache is first brought up to date, which only asks
+    PMG for what arrived since the last fetch.
+    """
+    client_id = user["client_id"]
+    matcher = await run_in_threadpool(get_matcher_for_client, client_id)
+    if not matcher:
+        raise HTTPException(status_code=404, detail="No domains assigned to this client")
+    starttime, endtime = _window(starttime, endtime)
+
+    errors = []
+    if refresh:
+        await pmg_spam.get_spam_quarantine(client_id=client_id, starttime=starttime, endtime=endtime, errors=errors)
+
+    rows = await run_in_threadpool(spam_stats.query, starttime, endtime, matcher)
+    histogram = Counter()
+    for r in rows:
+        histogram[r["score"]] += r["count"]
+
+    return json_response({
+        "starttime": starttime, "endtime": endtime, "bucket": spam_stats.SPAM_STATS_BUCKET,
+        "total": sum(r["count"] for r in rows),
+        "groups": _groups(rows, group_by),
+        "score_histogram": {str(k): v for k, v in sorted(histogram.items())},
+        "partial": bool(errors), "errors": errors,
+    })
+
+@router.get("/mailflow")
+async def mailflow_stats(
+    starttime: Optional[int] = Query(None, ge=0, description="Unix start time (default: 7 days ago)"),
+    endtime: Optional[int] = Query(None, ge=0, description="Unix end time (default: now)"),
+    direction: str = Query("in", pattern="^(in|out)$", description="in: by recipient domain, out: by sender domain"),
+    group_by: str = Query("domain", pattern="^(domain|status|day|hour)$"),
+    user=Depends(client_auth)):
+    """
+    Tracking-center message counts for the client's domains grouped by domain,
+    delivery status, day or hour. Read from the tracker_rollup buckets that the
+    tracker sync maintains; "complete" is false when the window is not fully synced.
+    """
+    matcher = await run_in_threadpool(get_matcher_for_client, user["client_id"])
+    if not matcher:
+        raise HTTPException(status_code=404, detail="No domains assigned to this client")
+    starttime, endtime = _window(starttime, endtime)
+
+    rows = await run_in_threadpool(tracker_store.query_flow, starttime, endtime, matcher, direction)
+    return json_response({
+        "starttime": starttime, "endtime": endtime, "bucket": tracker_store.TRACKER_ROLLUP_BUCKET,
+        "direction": direction,
+        "total": sum(r["count"] for r in rows),
+        "groups": _groups(rows, group_by),
+        "complete": await run_in_threadpool(tracker_store.covers, starttime, endtime),
+    })
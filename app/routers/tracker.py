@@ -1,87 +1,286 @@
 # app/routers/tracker.py
-import os
-from fastapi import APIRouter, Depends, HTTPException, Query
+import re
+import time
+import heapq
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, Field
 from app.services.auth_service import client_auth
-from app.db import get_db
-from app.services import pmg_api
+from app.services import pmg_api, pmg_async, tracker_store
+from app.services.client_domains import get_matcher_for_client
+from app.services.domain_matcher import DomainMatcher
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from app.utils.streaming import wants_ndjson, ndjson_response
+from app.utils.responses import json_response
+from app.utils.cursor import encode_cursor, decode_cursor, position
 
 router = APIRouter()
 
 def _normalize_email(s: str) -> str:
     return s.strip().lower()
 
-def _matches_domain(item: dict, domains_set: set) -> bool:
+# address fields checked for the client's domains (shared with the tracker store's partitions)
+TRACKER_MATCH_KEYS = tracker_store.TRACKER_MATCH_KEYS
+
+def _matches_domain(item: dict, matcher: DomainMatcher) -> bool:
     # defensive checks across multiple likely fields
-    keys_to_check = [
-        "recipient", "to", "receiver", "rcpt_to", "receiver_address",
-        "user", "username", "mailbox", "from", "sender", "sender_address"
-    ]
-    domain_keys = ["receiver_domain", "rcpt_domain", "domain", "maildomain"]
-    for k in keys_to_check:
-        v = item.get(k)
-        if not v or not isinstance(v, str):
-            continue
-        lv = v.lower()
-        # direct mailbox check
-        for d in domains_set:
-            if lv.endswith("@" + d):
-                return True
-            if lv == d:
-                return True
-    for k in domain_keys:
-        v = item.get(k)
-        if not v:
-            continue
-        if isinstance(v, str) and v.lower() in domains_set:
-            return True
-    return False
+    return matcher.match_item(item, TRACKER_MATCH_KEYS)
+
+def _filters(matcher: DomainMatcher):
+    # sender or receiver may be the client's: xfilter looks at both; _matches_domain still decides
+    return pmg_api.plan_filters(matcher, "xfilter")
+
+def _uid(it: dict) -> str:
+    # try common unique fields, else fallback to composite key
+    if isinstance(it.get("id"), (str, int)):
+        return f"id:{it.get('id')}"
+    if it.get("message_id"):
+        return f"msgid:{it.get('message_id')}"
+    return f"{it.get('from')}_{it.get('recipient')}_{it.get('time', it.get('timestamp',''))}_{it.get('subject','')}"
+
+async def _store_batches(starttime: int, endtime: int, matcher: DomainMatcher, client_id: int):
+    batches = tracker_store.iter_tracking(starttime, endtime, matcher, client_id=client_id)
+    async for items in iterate_in_threadpool(batches):
+        yield None, None, items, None
+
+async def _live_page(starttime: int, endtime: int, matcher: DomainMatcher, page_size: int, after, errors: list) -> list:
+    """
+    k-way merge of every node's entries in (time, host, node, id) order, starting after `after`.
+    The window is walked forward in growing slices (pmg_api.page_windows) until a
+    slice leaves page_size entries: later slices can only hold later entries.
+    Nodes that could not be read are left out and reported in `errors`.
+    """
+    # nothing before the cursor's time can be on this page
+    start = max(starttime, after[0]) if after else starttime
+    filters = _filters(matcher)
+    page = []
+    for lo, hi in pmg_api.page_windows(start, endtime):
+        node_lists = []
+        batches = pmg_async.iter_tracker_batches(params={"starttime": lo, "endtime": hi}, filters=filters, stable=True)
+        async for host, node, items, error in batches:
+            if error is not None:
+                err = {"host": host, "node": node, "error": error} if node else {"host": host, "error": error}
+                if err not in errors:
+                    errors.append(err)
+                continue
+            node_lists.append(sorted((it for it in items if _matches_domain(it, matcher)), key=position))
+
+        for it in heapq.merge(*node_lists, key=position):
+            if after and position(it) <= after:
+                continue
+            page.append(it)
+            if len(page) >= page_size:
+                return page
+    return page
 
 @router.get("/tracking")
-def get_tracking(
+async def get_tracking(
+    request: Request,
     starttime: int = Query(..., description="Unix start time"),
     endtime: int = Query(..., description="Unix end time"),
+    page_size: Optional[int] = Query(None, ge=1, le=5000, description="Return one page of this size"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     user=Depends(client_auth)):
     """
     Returns tracking center entries belonging to the authenticated client's domains.
     - limit: max items to request per node (default 500)
+    With "Accept: application/x-ndjson" items are streamed as each node answers,
+    followed by a {"_summary": {"count", "errors"}} line.
+    With page_size (or cursor) one page is returned, oldest first, plus a next_cursor.
+    Hosts skipped by their circuit breaker (or failing) are listed in "errors"
+    and the response has "partial": true.
     """
     client_id = user["client_id"]
-    db = get_db()
-    rows = db.execute("SELECT domain FROM domains WHERE client_id = ?", (client_id,)).fetchall()
-    domains = [r["domain"] for r in rows]
-    if not domains:
+    matcher = await run_in_threadpool(get_matcher_for_client, client_id)
+    if not matcher:
         raise HTTPException(status_code=404, detail="No domains assigned to this client")
-    domains_set = set(d.lower() for d in domains)
 
-    # fetch all tracker items across configured hosts and nodes
+    errors = []
+    if page_size or cursor:
+        after = decode_cursor(cursor)
+        page_size = page_size or 50
+        try:
+            if await run_in_threadpool(tracker_store.covers, starttime, endtime):
+                page = await run_in_threadpool(tracker_store.page_tracking, starttime, endtime, matcher, page_size, after,
+                                              client_id)
+            else:
+                page = await _live_page(starttime, endtime, matcher, page_size, after, errors)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"PMG API error: {e}")
+
+        next_cursor = encode_cursor(position(page[-1])) if len(page) == page_size else None
+        return json_response({"count": len(page), "items": page, "next_cursor": next_cursor,
+                              "partial": bool(errors), "errors": errors})
+
+    if wants_ndjson(request):
+        if await run_in_threadpool(tracker_store.covers, starttime, endtime):
+            batches = _store_batches(starttime, endtime, matcher, client_id)
+        else:
+            batches = pmg_async.iter_tracker_batches(params={"starttime": starttime, "endtime": endtime},
+                                                     filters=_filters(matcher))
+        return ndjson_response(batches, keep=lambda it: _matches_domain(it, matcher), uid=_uid)
+
+    # windows already synced locally are answered from the tracker store;
+    # anything else is fetched across configured hosts and nodes
     try:
-        items = pmg_api.get_all_tracker(params={
-            "starttime": starttime,
-            "endtime": endtime
-        })
+        if await run_in_threadpool(tracker_store.covers, starttime, endtime):
+            items = await run_in_threadpool(tracker_store.query_tracking, starttime, endtime, matcher, client_id)
+        else:
+            items, errors = await pmg_async.fetch_all_tracker(params={
+                "starttime": starttime,
+                "endtime": endtime
+            }, filters=_filters(matcher))
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"PMG API error: {e}")
 
     # filter items by domain
-    filtered = [it for it in items if _matches_domain(it, domains_set)]
+    filtered = [it for it in items if _matches_domain(it, matcher)]
 
     # dedupe — use unique fields where possible
     seen = set()
     deduped = []
     for it in filtered:
-        # try common unique fields, else fallback to composite key
-        uid = None
-        if isinstance(it.get("id"), (str, int)):
-            uid = f"id:{it.get('id')}"
-        elif it.get("message_id"):
-            uid = f"msgid:{it.get('message_id')}"
-        else:
-            # composite key
-            uid = f"{it.get('from')}_{it.get('recipient')}_{it.get('time', it.get('timestamp',''))}_{it.get('subject','')}"
+        uid = _uid(it)
         if uid in seen:
             continue
         seen.add(uid)
         deduped.append(it)
 
-    return {"count": len(deduped), "items": deduped} 
+    return json_response({"count": len(deduped), "items": deduped, "partial": bool(errors), "errors": errors})
+
+
+async def tracking_job(client_id: int, params: dict, progress, errors: list):
+    """
+    Body of a "tracking" query job (/jobs): the rows GET /tracking would return,
+    in batches as nodes answer (or from the tracker store when it covers the window).
+    """
+    starttime, endtime = params["starttime"], params["endtime"]
+    matcher = await run_in_threadpool(get_matcher_for_client, client_id)
+    seen = set()
+
+    def fresh(items):
+        out = []
+        for it in items:
+            if not _matches_domain(it, matcher):
+                continue
+            uid = _uid(it)
+            if uid in seen:
+                continue
+            seen.add(uid)
+            out.append(it)
+        return out
+
+    if await run_in_threadpool(tracker_store.covers, starttime, endtime):
+        progress(1, 0)
+        async for _, _, items, _ in _store_batches(starttime, endtime, matcher, client_id):
+            yield fresh(items)
+        progress(0, 1)
+        return
+
+    batches = pmg_async.iter_tracker_batches(params={"starttime": starttime, "endtime": endtime},
+                                             filters=_filters(matcher), progress=progress)
+    async for host, node, items, error in batches:
+        if error is not None:
+            errors.append({"host": host, "node": node, "error": error} if node else {"host": host, "error": error})
+            continue
+        yield fresh(items)
+
+
+# PMG tracker ids are queue ids plus counters; no path separators, never "." or ".."
+TRACKER_ID_RE = re.compile(r"^[A-Za-z0-9._-]+$")
+
+class DetailKey(BaseModel):
+    host: str
+    node: str
+    id: str
+    time: Optional[int] = None  # entry time from the tracking list; narrows the PMG lookup window
+
+class DetailsRequest(BaseModel):
+    items: List[DetailKey] = Field(..., min_length=1, max_length=500)
+
+def _detail_owned(detail: dict, matcher: DomainMatcher) -> bool:
+    # the log carries the sender and one entry per receiver
+    if _matches_domain(detail, matcher):
+        return True
+    return any(isinstance(r, dict) and _matches_domain(r, matcher) for r in detail.get("receivers") or [])
+
+@router.post("/tracking/details")
+async def get_tracking_details(payload: DetailsRequest, user=Depends(client_auth)):
+    """
+    Per-message logs (nodes/{node}/tracker/{id}) for up to 500 tracking entries in one call.
+    An entry is only returned if it belongs to the client's domains, judged on the
+    synced tracker row or else on the log itself; others come back as "not found".
+    Lookups run concurrently (PMG_DETAIL_PER_NODE per node); settled logs are cached without expiry.
+    """
+    matcher = await run_in_threadpool(get_matcher_for_client, user["client_id"])
+    if not matcher:
+        raise HTTPException(status_code=404, detail="No domains assigned to this client")
+
+    keys = []
+    for k in payload.items:
+        if k.host not in pmg_api.PMG_HOSTS:
+            raise HTTPException(status_code=400, detail=f"Unknown PMG host {k.host}")
+        known = pmg_api.cluster_nodes(k.host)
+        if not known:
+            # node cache still cold for this cluster
+            try:
+                known = set(await pmg_async.get_nodes(k.host))
+            except Exception:
+                known = set()
+        if k.node not in known:
+            raise HTTPException(status_code=400, detail=f"Unknown node {k.node} on {k.host}")
+        if not TRACKER_ID_RE.match(k.id) or k.id in (".", ".."):
+            raise HTTPException(status_code=400, detail=f"Invalid tracker id {k.id}")
+        # details are the same through every member of a cluster
+        keys.append((pmg_api.canonical_host(k.host), k.node, k.id))
+    keys = list(dict.fromkeys(keys))
+    times = {(pmg_api.canonical_host(k.host), k.node, k.id): k.time for k in payload.items}
+
+    rows = await run_in_threadpool(tracker_store.lookup_entries, keys)
+    cached = await run_in_threadpool(tracker_store.get_details, keys)
+
+    def owned(key, detail=None) -> bool:
+        if key in rows:
+            return _matches_domain(rows[key], matcher)
+        return detail is not None and _detail_owned(detail, matcher)
+
+    now = int(time.time())
+    details, errors, settled = {}, [], {}
+
+    async def fetch(key):
+        host, node, id_ = key
+        t = (rows.get(key) or {}).get("time") or times.get(key)
+        params = {"starttime": t - 3600, "endtime": min(now, t + 86400)} if t else None
+        try:
+            detail = await pmg_async.get_tracker_detail(host, node, id_, params=params)
+        except Exception as e:
+            errors.append({"host": host, "node": node, "id": id_, "error": str(e)})
+            return
+        # cached whether owned or not: ownership is checked again on every read
+        t = t or detail.get("time")
+        if isinstance(t, int) and t < now - tracker_store.TRACKER_DETAIL_SETTLE:
+            settled[key] = detail
+        if not owned(key, detail):
+            errors.append({"host": host, "node": node, "id": id_, "error": "not found"})
+            return
+        details[key] = detail
+
+    pending = []
+    for key in keys:
+        if key in rows and not owned(key):
+            errors.append({"host": key[0], "node": key[1], "id": key[2], "error": "not found"})
+        elif key in cached:
+            if owned(key, cached[key]):
+                details[key] = cached[key]
+            else:
+                errors.append({"host": key[0], "node": key[1], "id": key[2], "error": "not found"})
+        else:
+            pending.append(fetch(key))
+    await asyncio.gather(*pending)
+    await run_in_threadpool(tracker_store.store_details, settled)
 
+    items = [{"host": k[0], "node": k[1], "id": k[2], "detail": details[k]} for k in keys if k in details]
+    # "not found" is the answer, not a failure; anything else means the result is incomplete
+    partial = any(e["error"] != "not found" for e in errors)
+    return json_response({"count": len(items), "items": items, "partial": partial, "errors": errors})
@@ -1,5 +1,137 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
 from fastapi import Header, HTTPException
-from app.db import get_db
+from app.db import db_connection
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+# how often a worker checks auth_revision for invalidations made by other worker processes
+AUTH_REVISION_CHECK = float(os.getenv("AUTH_REVISION_CHECK", "1"))
+
+
+class TokenCache:
+    """
+    Bounded LRU of token -> identity with a TTL, so authenticated requests
+    don't hit SQLite. Entries are dropped as soon as a token is rotated or
+    its user/client is deleted. With several worker processes, each one sees
+    the others' invalidations through a shared revision counter, read at most
+    every AUTH_REVISION_CHECK seconds; a change there clears the whole cache.
+    """
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: int = AUTH_CACHE_TTL,
+                 revision: Optional[Callable[[], int]] = None, bump: Optional[Callable[[], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._generation = 0
+        self._revision_fn = revision
+        self._bump_fn = bump
+        self._revision: Optional[int] = None
+        self._checked = 0.0
+
+    def _check_revision(self, now: float):
+        if self._revision_fn is None or now - self._checked < AUTH_REVISION_CHECK:
+            return
+        self._checked = now
+        revision = self._revision_fn()
+        with self._lock:
+            if revision != self._revision:
+                if self._revision is not None:
+                    self._generation += 1
+                    self._entries.clear()
+                self._revision = revision
+
+    def get(self, kind: str, token: str, load: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        key = (kind, token)
+        now = time.monotonic()
+        self._check_revision(now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+
+        identity = load(token)
+        if identity is None:
+            return None
+
+        with self._lock:
+            # an invalidation raced with the load: serve it, but don't cache it
+            if generation != self._generation:
+                return identity
+            self._entries[key] = (now, identity)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, kind: str, **match):
+        """
+        Drop every `kind` entry whose identity has all the given field values,
+        e.g. invalidate("client", client_id=3).
+        """
+        with self._lock:
+            self._generation += 1
+            for key in [k for k, (_, ident) in self._entries.items()
+                        if k[0] == kind and all(ident.get(f) == v for f, v in match.items())]:
+                del self._entries[key]
+        # tell the other worker processes
+        if self._bump_fn is not None:
+            self._bump_fn()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else None,
+            }
+
+
+def _load_revision() -> int:
+    with db_connection() as db:
+        row = db.execute("SELECT revision FROM auth_revision WHERE id = 1").fetchone()
+    return row["revision"] if row else 0
+
+def _bump_revision():
+    with db_connection() as db:
+        db.execute("UPDATE auth_revision SET revision = revision + 1 WHERE id = 1")
+        db.commit()
+
+
+token_cache = TokenCache(revision=_load_revision, bump=_bump_revision)
+
+
+def _load_admin(token: str) -> Optional[Dict[str, Any]]:
+    with db_connection() as db:
+        row = db.execute(
+            "SELECT id FROM admins WHERE token = ?", (token,)
+        ).fetchone()
+    return {"admin_id": row["id"]} if row else None
+
+def _load_client(token: str) -> Optional[Dict[str, Any]]:
+    with db_connection() as db:
+        row = db.execute(
+            "SELECT id, client_id FROM client_users WHERE token = ?", (token,)
+        ).fetchone()
+    return {"user_id": row["id"], "client_id": row["client_id"]} if row else None
+
+def lookup_client_token(token: str) -> Optional[Dict[str, Any]]:
+    """
+    {"user_id", "client_id"} for a client token, or None; served from token_cache.
+    """
+    return token_cache.get("client", token, _load_client)
 
 def admin_auth(authorization: str = Header(None)):
     if not authorization:
@@ -10,26 +142,18 @@ def admin_auth(authorization: str = Header(None)):
 
     token = authorization.split("Bearer ")[1]
 
-    db = get_db()
-    row = db.execute(
-        "SELECT id FROM admins WHERE token = ?", (token,)
-    ).fetchone()
-
-    if not row:
+    identity = token_cache.get("admin", token, _load_admin)
+    if not identity:
         raise HTTPException(403, "Invalid admin token")
 
-    return {"admin_id": row["id"]}
+    return dict(identity)
 
 def client_auth(token: str = Header(None)):
     if not token:
         raise HTTPException(401, "Missing token")
 
-    db = get_db()
-    row = db.execute(
-        "SELECT id, client_id FROM client_users WHERE token = ?", (token,)
-    ).fetchone()
-
-    if not row:
+    identity = lookup_client_token(token)
+    if not identity:
         raise HTTPException(403, "Invalid token")
 
-    return {"user_id": row["id"], "client_id": row["client_id"]}
+    return dict(identity)
@@ -1,8 +1,107 @@
 # app/services/client_domains.py
-from app.db import get_db
+import os
+import time
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from app.db import db_connection
+from app.services.domain_matcher import DomainMatcher, domain_of
+
+# also match subdomains of assigned domains (mx.example.com for example.com)
+DOMAIN_MATCH_SUBDOMAINS = os.getenv("DOMAIN_MATCH_SUBDOMAINS", "false").lower() in ("true", "1", "yes")
+# upper bound on staleness when /domains is changed through another worker process
+DOMAIN_MATCHER_TTL = int(os.getenv("DOMAIN_MATCHER_TTL", "300"))
+
+_matchers: Dict[int, Tuple[float, DomainMatcher]] = {}
+_lock = threading.Lock()
+_generation = 0
 
 def get_domains_for_client(client_id: int):
-    conn = get_db()
-    cur = conn.execute("SELECT domain FROM domains WHERE client_id = ?", (client_id,))
-    rows = cur.fetchall()
+    with db_connection() as conn:
+        rows = conn.execute("SELECT domain FROM domains WHERE client_id = ?", (client_id,)).fetchall()
     return [row["domain"] for row in rows]
+
+def get_matcher_for_client(client_id: int) -> DomainMatcher:
+    """
+    Cached DomainMatcher for the client's domains; rebuilt after invalidate_client().
+    """
+    with _lock:
+        cached = _matchers.get(client_id)
+        generation = _generation
+    if cached and time.monotonic() - cached[0] < DOMAIN_MATCHER_TTL:
+        return cached[1]
+
+    matcher = DomainMatcher(get_domains_for_client(client_id), subdomains=DOMAIN_MATCH_SUBDOMAINS)
+    with _lock:
+        # don't cache a list read before a concurrent invalidation
+        if generation == _generation:
+            _matchers[client_id] = (time.monotonic(), matcher)
+    return matcher
+
+def invalidate_client(client_id: Optional[int] = None):
+    """
+    Drop the cached matcher for client_id (or for every client).
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        if client_id is None:
+            _matchers.clear()
+        else:
+            _matchers.pop(client_id, None)
+
+
+def fingerprint(domains: Iterable[str], subdomains: bool = DOMAIN_MATCH_SUBDOMAINS) -> str:
+    # identifies a client's domain set; a partition built for another set is stale
+    return ("sub:" if subdomains else "") + ",".join(sorted(domains))
+
+
+class DomainIndex:
+    """
+    Reverse of the domains table: domain -> owning client ids. With
+    subdomains, owners() also collects the clients of every parent domain,
+    matching what DomainMatcher(subdomains=True) accepts.
+    """
+
+    _NONE: FrozenSet[int] = frozenset()
+
+    def __init__(self, rows: Iterable[Tuple[int, str]], subdomains: bool = DOMAIN_MATCH_SUBDOMAINS):
+        self.subdomains = subdomains
+        by_domain: Dict[str, Set[int]] = {}
+        self.by_client: Dict[int, Set[str]] = {}
+        for client_id, domain in rows:
+            d = domain_of(domain)
+            if d:
+                by_domain.setdefault(d, set()).add(client_id)
+                self.by_client.setdefault(client_id, set()).add(d)
+        self.by_domain: Dict[str, FrozenSet[int]] = {d: frozenset(c) for d, c in by_domain.items()}
+
+    def owners(self, domain: Optional[str]) -> FrozenSet[int]:
+        if not domain:
+            return self._NONE
+        if not self.subdomains:
+            return self.by_domain.get(domain, self._NONE)
+        out: Set[int] = set()
+        labels = domain.split(".")
+        for i in range(len(labels)):
+            out.update(self.by_domain.get(".".join(labels[i:]), ()))
+        return frozenset(out)
+
+    def clients(self) -> List[int]:
+        return sorted(self.by_client)
+
+    def fingerprint(self, client_id: int) -> str:
+        return fingerprint(self.by_client.get(client_id, ()), self.subdomains)
+
+    def only(self, client_ids: Iterable[int]) -> "DomainIndex":
+        # the same index restricted to some clients
+        keep = set(client_ids)
+        return DomainIndex(((c, d) for c, ds in self.by_client.items() if c in keep for d in ds), self.subdomains)
+
+
+def load_domain_index() -> DomainIndex:
+    """
+    DomainIndex over every client's domains, read fresh from the database.
+    """
+    with db_connection() as conn:
+        rows = conn.execute("SELECT client_id, domain FROM domains").fetchall()
+    return DomainIndex((r["client_id"], r["domain"]) for r in rows)
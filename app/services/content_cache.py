@@ -0,0 +1,180 @@
+# app/services/content_cache.py
+import os
+import gzip
+import hashlib
+import tempfile
+import threading
+from typing import Iterator, Optional
+
+CONTENT_CACHE_DIR = os.getenv("CONTENT_CACHE_DIR", "content_cache")
+CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# layout: keys/<sha256(host, id)> holds the content hash,
+#         blobs/<content hash>.gz holds the gzip-compressed body (shared by identical mails)
+_KEYS = os.path.join(CONTENT_CACHE_DIR, "keys")
+_BLOBS = os.path.join(CONTENT_CACHE_DIR, "blobs")
+_lock = threading.Lock()
+# bytes in blobs/, counted once and then kept up to date by commit() and evict()
+_total: Optional[int] = None
+# eviction frees down to this share of CONTENT_CACHE_MAX_BYTES so it does not run on every commit
+_LOW_WATER = 0.9
+
+
+def _key(host: str, id: str) -> str:
+    return hashlib.sha256(f"{host}\0{id}".encode()).hexdigest()
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(_BLOBS, digest + ".gz")
+
+def etag(host: str, id: str) -> Optional[str]:
+    """
+    Content hash of the cached body for host/id (used as ETag), or None on a miss.
+    """
+    try:
+        with open(os.path.join(_KEYS, _key(host, id))) as f:
+            digest = f.read().strip()
+    except OSError:
+        return None
+    if os.path.exists(_blob_path(digest)):
+        return digest
+    # blob evicted by another process
+    _remove(os.path.join(_KEYS, _key(host, id)))
+    return None
+
+def iter_content(digest: str) -> Iterator[bytes]:
+    """
+    Decompressed body of a cached blob, in chunks. Touches the blob for LRU.
+    """
+    path = _blob_path(digest)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    with gzip.open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class Writer:
+    """
+    Tee for an upstream body: write() chunks as they are streamed to the client,
+    then commit() once the body is complete. Anything else discards the temp file.
+    All of it is blocking file I/O: async callers run it in a worker thread.
+    """
+
+    def __init__(self, host: str, id: str):
+        os.makedirs(_KEYS, exist_ok=True)
+        os.makedirs(_BLOBS, exist_ok=True)
+        self.key = _key(host, id)
+        self._hash = hashlib.sha256()
+        fd, self._tmp = tempfile.mkstemp(dir=_BLOBS, suffix=".tmp")
+        self._gz = gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb")
+
+    def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self._gz.write(chunk)
+
+    def commit(self) -> str:
+        global _total
+        fileobj = self._gz.fileobj
+        self._gz.close()
+        fileobj.close()
+        digest = self._hash.hexdigest()
+        path = _blob_path(digest)
+        size = os.path.getsize(self._tmp)
+        with _lock:
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(self._tmp, path)
+            if _total is not None:
+                _total += size - old
+
+        key_tmp = os.path.join(_KEYS, self.key + ".tmp")
+        with open(key_tmp, "w") as f:
+            f.write(digest)
+        os.replace(key_tmp, os.path.join(_KEYS, self.key))
+
+        evict()
+        return digest
+
+    def discard(self):
+        try:
+            fileobj = self._gz.fileobj
+            self._gz.close()
+            fileobj.close()
+        finally:
+            _remove(self._tmp)
+
+
+def put(host: str, id: str, chunks) -> str:
+    """
+    Cache a body that is already complete; returns its content hash (the ETag).
+    """
+    writer = Writer(host, id)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.commit()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _scan() -> list:
+    # (mtime, size, path) of every blob
+    try:
+        entries = [e for e in os.scandir(_BLOBS) if e.name.endswith(".gz")]
+    except OSError:
+        return []
+    return [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries]
+
+def evict(max_bytes: int = CONTENT_CACHE_MAX_BYTES):
+    """
+    Once the cache is over max_bytes, delete least recently used blobs, and the
+    key files pointing at them, until it is back under the low-water mark.
+    Only then is the blobs directory scanned; otherwise the running total decides.
+    """
+    global _total
+    with _lock:
+        if _total is not None and _total <= max_bytes:
+            return
+        blobs = _scan()
+        _total = sum(size for _, size, _ in blobs)
+        if _total <= max_bytes:
+            return
+        removed = set()
+        for _, size, path in sorted(blobs):
+            if _total <= max_bytes * _LOW_WATER:
+                break
+            _remove(path)
+            _total -= size
+            removed.add(os.path.basename(path)[:-len(".gz")])
+    _remove_keys(removed)
+
+def _remove_keys(digests: set):
+    if not digests:
+        return
+    try:
+        entries = list(os.scandir(_KEYS))
+    except OSError:
+        return
+    for e in entries:
+        try:
+            with open(e.path) as f:
+                if f.read().strip() in digests:
+                    _remove(e.path)
+        except OSError:
+            pass
+
+def stats() -> dict:
+    sizes = [size for _, size, _ in _scan()]
+    return {"blobs": len(sizes), "bytes": sum(sizes), "max_bytes": CONTENT_CACHE_MAX_BYTES}
@@ -0,0 +1,74 @@
+# app/services/domain_matcher.py
+from typing import Any, Dict, Iterable, Optional
+
+
+def domain_of(value: Any) -> Optional[str]:
+    """
+    Lower-cased domain part of an address ("user@example.com" -> "example.com").
+    A value without "@" is taken to be a bare domain.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    v = value.strip().lower()
+    if "@" in v:
+        v = v.rsplit("@", 1)[1]
+    v = v.strip("<> .")
+    return v or None
+
+
+class DomainMatcher:
+    """
+    Precompiled set of client domains.
+
+    Exact matches are a single hash-set lookup per address. With subdomains=True
+    a reversed-label trie also accepts any subdomain of a listed domain
+    ("mx.example.com" matches "example.com").
+    """
+
+    _END = object()
+
+    def __init__(self, domains: Iterable[str], subdomains: bool = False):
+        self.domains = frozenset(d for d in (domain_of(x) for x in domains) if d)
+        self.subdomains = subdomains
+        self._trie: Dict[Any, Any] = {}
+        if subdomains:
+            for d in self.domains:
+                node = self._trie
+                for label in reversed(d.split(".")):
+                    node = node.setdefault(label, {})
+                node[self._END] = True
+
+    def __bool__(self) -> bool:
+        return bool(self.domains)
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+    def match_domain(self, domain: Optional[str]) -> bool:
+        if not domain:
+            return False
+        if domain in self.domains:
+            return True
+        if not self.subdomains:
+            return False
+        node = self._trie
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+    def match_address(self, value: Any) -> bool:
+        return self.match_domain(domain_of(value))
+
+    def match_item(self, item: Dict[str, Any], keys: Iterable[str]) -> bool:
+        """
+        True if any of item[k] for k in keys is an address or domain we own.
+        """
+        for k in keys:
+            v = item.get(k)
+            if v and isinstance(v, str) and self.match_domain(domain_of(v)):
+                return True
+        return False
@@ -3,8 +3,12 @@ import os
 from dotenv import load_dotenv
 import requests
 import time
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from urllib.parse import urljoin
+from . import pmg_health, pmg_limiter
+from .domain_matcher import DomainMatcher
 
 load_dotenv()
 
@@ -13,6 +17,33 @@ PMG_USERNAME = os.getenv("PMG_USERNAME")
 PMG_PASSWORD = os.getenv("PMG_PASSWORD")
 PMG_VERIFY_SSL = os.getenv("PMG_VERIFY_SSL", "false").lower() in ("true", "1", "yes")
 REQUEST_TIMEOUT = int(os.getenv("PMG_REQ_TIMEOUT", "20"))
+# PMG tickets are valid for 2 hours; renew well before that
+PMG_TICKET_TTL = int(os.getenv("PMG_TICKET_TTL", "5400"))
+# tracker node fetches in flight across all requests (and size of the sync chunk pool)
+PMG_FANOUT_WORKERS = int(os.getenv("PMG_FANOUT_WORKERS", "16"))
+# cluster membership rarely changes; cached node lists are refreshed after this many seconds
+PMG_NODES_TTL = int(os.getenv("PMG_NODES_TTL", "3600"))
+# how often /config/cluster/status is re-read per host
+PMG_CLUSTER_TTL = int(os.getenv("PMG_CLUSTER_TTL", "3600"))
+# round tracker windows to this many seconds so near-identical queries coalesce (0 = off)
+PMG_COALESCE_BUCKET = int(os.getenv("PMG_COALESCE_BUCKET", "0"))
+# tracker windows longer than this are fetched per node in time chunks
+PMG_CHUNK_THRESHOLD = int(os.getenv("PMG_CHUNK_THRESHOLD", "21600"))
+# chunk length bounds (chunk edges fall on PMG_CHUNK_MIN boundaries) and first guess before any density is known
+PMG_CHUNK_MIN = int(os.getenv("PMG_CHUNK_MIN", "900"))
+PMG_CHUNK_MAX = int(os.getenv("PMG_CHUNK_MAX", "86400"))
+PMG_CHUNK_INITIAL = int(os.getenv("PMG_CHUNK_INITIAL", "3600"))
+# rows PMG may return per tracker query (sent as `limit`); a window that comes back
+# with this many rows was cut short and is fetched again in halves
+PMG_TRACKER_LIMIT = int(os.getenv("PMG_TRACKER_LIMIT", "5000"))
+# rows a chunk should return, judged by the node's row density so far; well below PMG_TRACKER_LIMIT
+PMG_CHUNK_ROWS = int(os.getenv("PMG_CHUNK_ROWS", "1000"))
+# chunks in flight per node, and how often a failed chunk is retried on its own
+PMG_CHUNKS_PER_NODE = int(os.getenv("PMG_CHUNKS_PER_NODE", "4"))
+PMG_CHUNK_RETRIES = int(os.getenv("PMG_CHUNK_RETRIES", "2"))
+# tenant domains are pushed into PMG tracker filters when that takes at most
+# this many filtered queries per node; more means a full scan (0 = never push down)
+PMG_PUSHDOWN_MAX_QUERIES = int(os.getenv("PMG_PUSHDOWN_MAX_QUERIES", "4"))
 
 if not PMG_USERNAME or not PMG_PASSWORD:
     raise ValueError("PMG_USERNAME and PMG_PASSWORD must be set in env")
@@ -20,7 +51,10 @@ if not PMG_USERNAME or not PMG_PASSWORD:
 def _base_api_url(host: str) -> str:
     return f"https://{host}/api2/json/"
 
-def login_and_get_session(host: str):
+def _login(host: str) -> Dict[str, Any]:
+    """
+    Run a full POST /access/ticket login against a host.
+    """
     session = requests.Session()
     session.verify = PMG_VERIFY_SSL
 
@@ -30,7 +64,7 @@ def login_and_get_session(host: str):
         "password": PMG_PASSWORD
     }
 
-    resp = session.post(url, data=payload, timeout=REQUEST_TIMEOUT)
+    resp = session.post(url, data=payload, timeout=(pmg_health.PMG_CONNECT_TIMEOUT, REQUEST_TIMEOUT))
     resp.raise_for_status()
 
     j = resp.json()
@@ -45,80 +79,807 @@ def login_and_get_session(host: str):
     # PMG requires PMGAuthCookie to be set manually
     session.cookies.set("PMGAuthCookie", ticket, domain=host.split(':')[0])
 
-    return {"session": session, "csrf": csrf}
+    return {"session": session, "csrf": csrf, "ticket": ticket, "issued_at": time.monotonic()}
 
 
-def get_nodes(host: str) -> List[str]:
+class PMGSessionManager:
     """
-    Fetch node names from a single host using an authenticated session.
+    Keeps one authenticated requests.Session per PMG host and re-uses its
+    PMGAuthCookie / CSRF token until the ticket is close to expiry.
     """
-    s = login_and_get_session(host)
-    session = s["session"]
-    csrf = s.get("csrf")
 
-    headers = {}
-    if csrf:
-        headers["CSRFPreventionToken"] = csrf
+    def __init__(self, ttl: int = PMG_TICKET_TTL):
+        self.ttl = ttl
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._host_locks: Dict[str, threading.Lock] = {}
+        self._stats = {"login_hits": 0, "login_misses": 0, "relogins_401": 0}
 
-    url = _base_api_url(host) + "nodes"
-    r = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-    r.raise_for_status()
-    j = r.json()
-    data = j.get("data") or []
+    def _host_lock(self, host: str) -> threading.Lock:
+        with self._lock:
+            lock = self._host_locks.get(host)
+            if lock is None:
+                lock = self._host_locks[host] = threading.Lock()
+            return lock
+
+    def _fresh(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return entry is not None and time.monotonic() - entry["issued_at"] < self.ttl
+
+    def get(self, host: str) -> Dict[str, Any]:
+        """
+        Return the cached session for host, logging in if missing or stale.
+        """
+        entry = self._sessions.get(host)
+        if self._fresh(entry):
+            with self._lock:
+                self._stats["login_hits"] += 1
+            return entry
+
+        # one login per host at a time; other callers wait and re-use it
+        with self._host_lock(host):
+            entry = self._sessions.get(host)
+            if self._fresh(entry):
+                with self._lock:
+                    self._stats["login_hits"] += 1
+                return entry
+
+            entry = _login(host)
+            with self._lock:
+                self._stats["login_misses"] += 1
+                old = self._sessions.get(host)
+                self._sessions[host] = entry
+            if old is not None:
+                old["session"].close()
+            return entry
+
+    def invalidate(self, host: str, entry: Optional[Dict[str, Any]] = None):
+        """
+        Drop the cached session for host (only if it is still `entry`, when given).
+        """
+        with self._lock:
+            current = self._sessions.get(host)
+            if current is None or (entry is not None and current is not entry):
+                return
+            del self._sessions[host]
+        current["session"].close()
+
+    def request(self, host: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send an authenticated request, re-logging in once if PMG answers 401.
+        Goes through the host's circuit breaker (pmg_health) and upstream limiter
+        (pmg_limiter); unless the caller passes one, the read timeout follows the
+        host's observed latency.
+        """
+        health = pmg_health.get(host)
+        health.before_request()
+        span = pmg_health.window_span(url, kwargs.get("params"))
+        kind = pmg_health.request_kind(url, kwargs.get("params"))
+        kwargs.setdefault("timeout", (pmg_health.PMG_CONNECT_TIMEOUT, health.timeout(kind)))
+
+        # waits for a slot and a token of the host's adaptive limiter
+        limiter = pmg_limiter.get(host)
+        limiter.acquire()
+        started = time.monotonic()
+        try:
+            r = self._send(host, method, url, **kwargs)
+        except Exception as e:
+            limiter.release(kind, time.monotonic() - started)
+            if isinstance(e, requests.exceptions.ReadTimeout) and pmg_health.large_window(span):
+                # a long scan outgrowing its timeout says nothing about the host
+                health.abandon()
+            else:
+                health.record_failure()
+            raise
+        elapsed = time.monotonic() - started
+        limiter.release(kind, elapsed, r.status_code, pmg_limiter.retry_after(r.headers))
+        if r.status_code >= 500:
+            health.record_failure()
+        else:
+            health.record_success(kind, elapsed)
+        return r
+
+    def _send(self, host: str, method: str, url: str, **kwargs) -> requests.Response:
+        extra_headers = kwargs.pop("headers", None) or {}
+
+        for attempt in range(2):
+            entry = self.get(host)
+            headers = dict(extra_headers)
+            if entry.get("csrf"):
+                headers["CSRFPreventionToken"] = entry["csrf"]
+
+            r = entry["session"].request(method, url, headers=headers, **kwargs)
+            if r.status_code != 401 or attempt:
+                return r
+
+            r.close()
+            with self._lock:
+                self._stats["relogins_401"] += 1
+            self.invalidate(host, entry)
+        return r
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["cached_hosts"] = sorted(self._sessions)
+        total = out["login_hits"] + out["login_misses"]
+        out["hit_rate"] = round(out["login_hits"] / total, 4) if total else None
+        return out
+
+
+sessions = PMGSessionManager()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls: the first caller for a key runs it,
+    callers arriving while it is in flight wait and get the same result.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "upstream": 0, "shared": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self._stats["requests"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                self._stats["upstream"] += 1
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        out["coalescing_ratio"] = round(out["shared"] / out["requests"], 4) if out["requests"] else None
+        return out
+
+
+def flight_key(host: str, path: str, params: Optional[Dict[str, Any]]) -> tuple:
+    return (host, path, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+
+def round_window(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Widen starttime/endtime to PMG_COALESCE_BUCKET boundaries so near-identical
+    windows share one upstream query. Callers trim the result with in_window().
+    """
+    if not PMG_COALESCE_BUCKET or not params:
+        return params
+    out = dict(params)
+    b = PMG_COALESCE_BUCKET
+    if out.get("starttime") is not None:
+        out["starttime"] = int(out["starttime"]) // b * b
+    if out.get("endtime") is not None:
+        out["endtime"] = -(-int(out["endtime"]) // b) * b
+    return out
+
+def in_window(items: List[Dict[str, Any]], params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop rows outside the caller's original window after round_window() widened it.
+    """
+    if not PMG_COALESCE_BUCKET or not params:
+        return items
+    start, end = params.get("starttime"), params.get("endtime")
+    return [
+        it for it in items
+        if (start is None or (it.get("time") or 0) >= int(start))
+        and (end is None or (it.get("time") or 0) <= int(end))
+    ]
+
+
+flights = SingleFlight()
 
+
+def api_get(host: str, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    GET api2/json/{path} on host and return the "data" member.
+    Identical concurrent GETs share one upstream request.
+    """
+    def fetch():
+        r = sessions.request(host, "GET", _base_api_url(host) + path, params=params or {})
+        r.raise_for_status()
+        j = r.json()
+        return j.get("data") if isinstance(j, dict) else j
+
+    return flights.do(flight_key(host, path, params), fetch)
+
+
+class NodeCache:
+    """
+    Last known node list per host. Entries older than ttl are still served
+    (stale-while-revalidate); callers refresh them in the background.
+    """
+
+    def __init__(self, ttl: int = PMG_NODES_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, host: str) -> Optional[Tuple[List[str], bool]]:
+        """
+        Return (nodes, stale) for host, or None if it was never fetched.
+        """
+        with self._lock:
+            e = self._entries.get(host)
+            if e is None or e["nodes"] is None:
+                return None
+            return list(e["nodes"]), time.time() - e["fetched_at"] >= self.ttl
+
+    def begin_refresh(self, host: str) -> bool:
+        """
+        Claim the refresh for host; False if one is already running.
+        """
+        with self._lock:
+            e = self._entries.setdefault(host, {"nodes": None, "fetched_at": 0, "changed_at": None,
+                                                "refreshing": False, "last_error": None})
+            if e["refreshing"]:
+                return False
+            e["refreshing"] = True
+            return True
+
+    def store(self, host: str, nodes: List[str]) -> bool:
+        """
+        Save a fresh node list; returns True if the topology changed.
+        """
+        with self._lock:
+            e = self._entries.setdefault(host, {"nodes": None, "fetched_at": 0, "changed_at": None,
+                                                "refreshing": False, "last_error": None})
+            changed = e["nodes"] is not None and e["nodes"] != nodes
+            if e["nodes"] is None or changed:
+                e["changed_at"] = time.time()
+            e.update(nodes=list(nodes), fetched_at=time.time(), refreshing=False, last_error=None)
+        if changed:
+            print(f"PMG topology change on {host}: {nodes}")
+        return changed
+
+    def fail(self, host: str, error: Exception) -> List[str]:
+        """
+        Record a failed refresh and return the last known list instead; re-raises if there is none.
+        """
+        with self._lock:
+            e = self._entries.get(host)
+            if e is not None:
+                e.update(refreshing=False, last_error=str(error))
+        cached = self.lookup(host)
+        if cached is None:
+            raise error
+        print(f"PMG /nodes failed on {host}, using last known topology: {error}")
+        return cached[0]
+
+    def serve(self, host: str) -> Tuple[Optional[List[str]], bool]:
+        """
+        (nodes, refresh) for a lookup: nodes is None if the caller has to fetch them
+        first; refresh is True if the caller claimed a background refresh of a stale list.
+        """
+        cached = self.lookup(host)
+        if cached is None:
+            return None, False
+        nodes, stale = cached
+        return nodes, stale and self.begin_refresh(host)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {h: {k: v for k, v in e.items() if k != "refreshing"} for h, e in self._entries.items()}
+
+
+node_cache = NodeCache()
+
+
+def node_names(data: Optional[List[Dict[str, Any]]]) -> List[str]:
+    """
+    Node names from a /nodes response.
+    """
     nodes = []
-    for n in data:
+    for n in data or []:
         node_name = n.get("node") or n.get("name")
         if node_name:
             nodes.append(node_name)
     return nodes
 
-def get_tracker_for_node(host: str, node: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+def refresh_nodes(host: str) -> List[str]:
     """
-    Query nodes/{node}/tracker on a specific host.
+    Re-read /nodes for host into node_cache, falling back to the last known list on error.
     """
-    s = login_and_get_session(host)
-    session = s["session"]
-    csrf = s.get("csrf")
+    node_cache.begin_refresh(host)
+    try:
+        nodes = node_names(api_get(host, "nodes"))
+    except Exception as e:
+        return node_cache.fail(host, e)
+    node_cache.store(host, nodes)
+    return nodes
 
-    headers = {}
-    if csrf:
-        headers["CSRFPreventionToken"] = csrf
+def _refresh_nodes_quietly(host: str):
+    try:
+        refresh_nodes(host)
+    except Exception as e:
+        print(f"PMG node refresh failed on {host}: {e}")
 
-    url = _base_api_url(host) + f"nodes/{node}/tracker"
-    r = session.get(url, headers=headers, params=params or {}, timeout=REQUEST_TIMEOUT)
-    r.raise_for_status()
-    j = r.json()
-    return j.get("data") or []
+def get_nodes(host: str) -> List[str]:
+    """
+    Node names for a single host, served from node_cache.
+    Only the very first lookup for a host waits on /nodes.
+    Raises pmg_health.HostUnavailable while the host's breaker is open.
+    """
+    pmg_health.check(host)
+    nodes, refresh = node_cache.serve(host)
+    if nodes is None:
+        return refresh_nodes(host)
+    if refresh:
+        threading.Thread(target=_refresh_nodes_quietly, args=(host,), daemon=True).start()
+    return nodes
 
-def get_all_tracker(params: Optional[Dict[str, Any]] = None, limit_per_node: int = 500) -> List[Dict[str, Any]]:
+class ClusterMap:
     """
-    Fetch tracker data from all nodes across all hosts.
+    Cluster membership per host from /config/cluster/status. Hosts reporting the
+    same member list are one PMG cluster and share their (replicated) quarantine.
+    Hosts not yet discovered, or standalone, form a cluster of their own.
     """
-    all_items = []
-    errors = []
 
+    def __init__(self, ttl: int = PMG_CLUSTER_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def cluster_id(self, host: str) -> str:
+        with self._lock:
+            e = self._entries.get(host)
+            return e["cluster"] if e and e["cluster"] else host
+
+    def needs_refresh(self, host: str) -> bool:
+        """
+        Claim a refresh for host if it was never discovered or is older than ttl.
+        """
+        with self._lock:
+            e = self._entries.setdefault(host, {"cluster": None, "members": [], "fetched_at": 0,
+                                                "refreshing": False, "last_error": None,
+                                                "discovered": False})
+            if e["refreshing"] or time.time() - e["fetched_at"] < self.ttl:
+                return False
+            e["refreshing"] = True
+            return True
+
+    def discovered(self, host: str) -> bool:
+        """
+        True once host's membership has been read successfully at least once.
+        """
+        with self._lock:
+            e = self._entries.get(host)
+            return bool(e and e["discovered"])
+
+    def store(self, host: str, members: List[str]):
+        # a standalone PMG returns an empty list
+        cluster = ",".join(sorted(members)) if members else None
+        with self._lock:
+            e = self._entries[host]
+            if e["cluster"] != cluster and e["discovered"]:
+                print(f"PMG cluster change on {host}: {members}")
+            e.update(cluster=cluster, members=sorted(members), fetched_at=time.time(),
+                     refreshing=False, last_error=None, discovered=True)
+
+    def fail(self, host: str, error: Exception):
+        with self._lock:
+            e = self._entries.get(host)
+            if e is not None:
+                # retry on the next lookup after a short pause instead of a full ttl
+                e.update(refreshing=False, last_error=str(error),
+                         fetched_at=time.time() - self.ttl + min(self.ttl, 60))
+
+    def groups(self, hosts: List[str]) -> List[List[str]]:
+        """
+        hosts grouped by cluster, in first-seen order.
+        """
+        out: Dict[str, List[str]] = {}
+        for host in hosts:
+            out.setdefault(self.cluster_id(host), []).append(host)
+        return list(out.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {h: {k: v for k, v in e.items() if k != "refreshing"} for h, e in self._entries.items()}
+
+
+cluster_map = ClusterMap()
+
+
+def refresh_cluster(host: str) -> Optional[str]:
+    """
+    Re-read /config/cluster/status for host into cluster_map.
+    """
+    cluster_map.needs_refresh(host)
+    try:
+        status = api_get(host, "config/cluster/status") or []
+    except Exception as e:
+        cluster_map.fail(host, e)
+        raise
+    cluster_map.store(host, [m.get("name") for m in status if m.get("name")])
+    return cluster_map.cluster_id(host)
+
+def _refresh_cluster_quietly(host: str):
+    try:
+        refresh_cluster(host)
+    except Exception as e:
+        print(f"PMG cluster discovery failed on {host}: {e}")
+
+def clusters() -> List[List[str]]:
+    """
+    PMG_HOSTS grouped by cluster. Unknown or stale membership is refreshed in the
+    background; until then such a host counts as its own cluster.
+    """
     for host in PMG_HOSTS:
-        try:
-            nodes = get_nodes(host)
-        except Exception as e:
-            errors.append({"host": host, "error": str(e)})
+        if cluster_map.needs_refresh(host):
+            threading.Thread(target=_refresh_cluster_quietly, args=(host,), daemon=True).start()
+    return cluster_map.groups(PMG_HOSTS)
+
+def preferred(hosts: List[str]) -> List[str]:
+    """
+    Members of one cluster in the order they should be asked: hosts whose breaker
+    admits requests first, fastest (median latency) first; unmeasured hosts count as fast.
+    """
+    def key(i_host):
+        i, host = i_host
+        health = pmg_health.get(host)
+        return (not health.available(), health.median_latency() or 0.0, i)
+    return [h for _, h in sorted(enumerate(hosts), key=key)]
+
+def plan_tracker(node_lists: Dict[str, List[str]], failures: Dict[str, str],
+                 stable: bool = False) -> Tuple[List[Tuple[str, str]], List[Dict[str, Any]]]:
+    """
+    (host, node) pairs covering every node once per cluster, plus host errors.
+    node_lists: nodes per host that answered; failures: error per host that did not.
+    Each node is asked through the preferred member that lists it (the first one
+    in PMG_HOSTS order with stable=True). A failed host is only an error if no
+    member of its cluster answered.
+    """
+    targets = []
+    errors = []
+    for group in clusters():
+        answered = [h for h in group if h in node_lists]
+        if not answered:
+            errors.extend({"host": h, "error": failures[h]} for h in group if h in failures)
             continue
+        seen = set()
+        for host in (answered if stable else preferred(answered)):
+            for node in node_lists[host]:
+                if node not in seen:
+                    seen.add(node)
+                    targets.append((host, node))
+        # nodes only a failed member was known to have are missing from the result
+        for host in group:
+            cached = node_cache.lookup(host) if host in failures else None
+            for node in (cached[0] if cached else []):
+                if node not in seen:
+                    seen.add(node)
+                    errors.append({"host": host, "node": node, "error": failures[host]})
+    return targets, errors
+
+def cluster_nodes(host: str) -> set:
+    """
+    Node names known (from the node cache) for any member of host's cluster.
+    """
+    cluster = cluster_map.cluster_id(host)
+    nodes = set()
+    for h in PMG_HOSTS:
+        if cluster_map.cluster_id(h) == cluster:
+            cached = node_cache.lookup(h)
+            if cached:
+                nodes.update(cached[0])
+    return nodes
+
+def canonical_host(host: str) -> str:
+    """
+    First PMG_HOSTS entry of host's cluster; used to key data that is the same via every member.
+    """
+    cluster = cluster_map.cluster_id(host)
+    for h in PMG_HOSTS:
+        if cluster_map.cluster_id(h) == cluster:
+            return h
+    return host
+
+def probe(host: str):
+    """
+    Cheap authenticated request used by the pmg_health recovery probe.
+    """
+    r = sessions.request(host, "GET", _base_api_url(host) + "version")
+    r.raise_for_status()
+
+def _warm_host(host: str):
+    _refresh_cluster_quietly(host)
+    _refresh_nodes_quietly(host)
+
+def warm_node_cache():
+    """
+    Fill node_cache and cluster_map for every host in the background (called on startup).
+    """
+    for host in PMG_HOSTS:
+        if cluster_map.needs_refresh(host):
+            threading.Thread(target=_warm_host, args=(host,), daemon=True).start()
+        else:
+            threading.Thread(target=_refresh_nodes_quietly, args=(host,), daemon=True).start()
+
+def page_windows(start: int, end: int, newest_first: bool = False) -> Iterator[Tuple[int, int]]:
+    """
+    Consecutive slices of [start, end] for paged fan-outs, from start (or from end
+    with newest_first), PMG_CHUNK_INITIAL long and doubling each time: a page that
+    fills in the first slice costs one short query, a sparse one a few more.
+    """
+    length = PMG_CHUNK_INITIAL
+    while start <= end:
+        if newest_first:
+            lo = max(start, end - length + 1)
+            yield lo, end
+            end = lo - 1
+        else:
+            hi = min(end, start + length - 1)
+            yield start, hi
+            start = hi + 1
+        length *= 2
+
+# rows per second, per (host, node, filter): a filtered query is far sparser than a full scan
+_density: Dict[Tuple[str, str, str], float] = {}
+_density_lock = threading.Lock()
+
+
+class TrackerChunks:
+    """
+    One node's tracker window cut into time chunks. Workers claim() the next
+    chunk as they go, so its length follows the row density of the chunks
+    fetched before it (about PMG_CHUNK_ROWS rows each); stitch() puts the
+    results back in time order. Shared by the sync and async fetchers.
+    """
+
+    def __init__(self, host: str, node: str, params: Dict[str, Any], start: int, end: int):
+        self.key = (host, node, "&".join(f"{k}={v}" for k, v in sorted(params.items())
+                                         if k not in ("starttime", "endtime")))
+        self.params = params
+        self.cursor = start
+        self.end = end
+        self.results: Dict[int, List[Dict[str, Any]]] = {}
+        self.aborted = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def plan(cls, host: str, node: str, params: Optional[Dict[str, Any]]) -> Optional["TrackerChunks"]:
+        # None: the window is short (or open-ended at the start) and goes out as one query
+        if not params or params.get("starttime") is None:
+            return None
+        start = int(params["starttime"])
+        end = int(params["endtime"]) if params.get("endtime") is not None else int(time.time())
+        if end - start <= PMG_CHUNK_THRESHOLD:
+            return None
+        return cls(host, node, params, start, end)
 
-        for node in nodes:
-            try:
-                query_params = params if params else None
+    def _length(self) -> int:
+        with _density_lock:
+            density = _density.get(self.key)
+        if density is None:
+            return PMG_CHUNK_INITIAL
+        if density <= 0:
+            return PMG_CHUNK_MAX
+        return int(min(PMG_CHUNK_MAX, max(PMG_CHUNK_MIN, PMG_CHUNK_ROWS / density)))
 
-                items = get_tracker_for_node(host, node, params=query_params)
-                for it in items:
-                    it["_pmg_host"] = host
-                    it["_pmg_node"] = node
-                all_items.extend(items)
-                time.sleep(0.07)
-            except Exception as e:
-                errors.append({"host": host, "node": node, "error": str(e)})
+    def claim(self) -> Optional[Tuple[int, int]]:
+        """
+        Next (start, end) to fetch, or None when the window is used up or a chunk gave up.
+        """
+        length = self._length()
+        with self._lock:
+            if self.aborted or self.cursor > self.end:
+                return None
+            start = self.cursor
+            edge = max((start + length) // PMG_CHUNK_MIN, start // PMG_CHUNK_MIN + 1) * PMG_CHUNK_MIN
+            end = min(self.end, edge - 1)
+            self.cursor = end + 1
+            return start, end
 
-    if errors:
-        print("PMG fetch errors:", errors)
+    def params_for(self, chunk: Tuple[int, int]) -> Dict[str, Any]:
+        return {**self.params, "starttime": chunk[0], "endtime": chunk[1]}
 
-    return all_items
+    def done(self, chunk: Tuple[int, int], items: List[Dict[str, Any]]):
+        seconds = chunk[1] - chunk[0] + 1
+        # a short tail chunk says little about density
+        if seconds >= PMG_CHUNK_MIN:
+            with _density_lock:
+                old = _density.get(self.key)
+                new = len(items) / seconds
+                _density[self.key] = new if old is None else 0.7 * old + 0.3 * new
+        with self._lock:
+            self.results[chunk[0]] = items
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+
+    def retry(self, chunk: Tuple[int, int], attempt: int, error: Exception) -> bool:
+        """
+        Whether a failed chunk is fetched again; if not, the whole window is given up.
+        An open breaker or a window too dense to split won't get better by retrying.
+        """
+        if attempt >= PMG_CHUNK_RETRIES or isinstance(error, (pmg_health.HostUnavailable, TrackerTruncated)):
+            self.abort()
+            return False
+        print(f"Tracker chunk {chunk} on {self.key[0]}/{self.key[1]} failed, retrying: {error}")
+        return True
+
+    def stitch(self) -> List[Dict[str, Any]]:
+        # a message logged across a chunk edge can show up in both chunks
+        out, seen = [], set()
+        for start in sorted(self.results):
+            for it in self.results[start]:
+                key = it.get("id")
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                out.append(it)
+        return out
+
+
+_chunk_lock = threading.Lock()
+_chunk_executor: Optional[ThreadPoolExecutor] = None
+_chunk_semaphores: Dict[Tuple[str, str], threading.Semaphore] = {}
+
+def _chunk_pool() -> ThreadPoolExecutor:
+    global _chunk_executor
+    with _chunk_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(max_workers=PMG_FANOUT_WORKERS, thread_name_prefix="pmg-chunk")
+        return _chunk_executor
+
+def _chunk_semaphore(host: str, node: str) -> threading.Semaphore:
+    with _chunk_lock:
+        sem = _chunk_semaphores.get((host, node))
+        if sem is None:
+            sem = _chunk_semaphores[(host, node)] = threading.Semaphore(PMG_CHUNKS_PER_NODE)
+        return sem
+
+def chunk_density() -> Dict[str, float]:
+    with _density_lock:
+        return {f"{h}/{n}" + (f"?{q}" if q else ""): round(d, 4) for (h, n, q), d in _density.items()}
+
+
+def _collapse(terms: set) -> set:
+    # PMG matches substrings: a term inside another one already finds its rows
+    return {t for t in terms if not any(u != t and u in t for u in terms)}
+
+def _parent(term: str) -> Optional[str]:
+    # only parents of three labels or more: without a public-suffix list "co.uk"
+    # cannot be told apart from "example.com", and batching on it is a full scan
+    labels = term.lstrip("@").split(".")
+    return ".".join(labels[1:]) if len(labels) > 3 else None
+
+def plan_filters(matcher: DomainMatcher, field: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Query plan for a tenant's tracker rows: one extra params dict per filtered
+    query on `field` ("target", "from" or "xfilter"), or None for a full scan.
+
+    PMG matches these filters as substrings, so "@example.com" finds the
+    domain's addresses and a bare "example.com" its subdomains as well. Domains
+    sharing a parent of at least three labels are batched into one query on the
+    parent when there are more than PMG_PUSHDOWN_MAX_QUERIES terms; if that is
+    still too many, a full scan is cheaper. Filtered queries can let foreign rows through (and miss
+    nothing), so callers keep filtering locally.
+    """
+    if not matcher or PMG_PUSHDOWN_MAX_QUERIES <= 0:
+        return None
+    terms = _collapse({d if matcher.subdomains else "@" + d for d in matcher.domains})
+    while len(terms) > PMG_PUSHDOWN_MAX_QUERIES:
+        groups: Dict[str, set] = {}
+        for t in terms:
+            groups.setdefault(_parent(t) or t, set()).add(t)
+        merged = _collapse({p if len(g) > 1 else t for p, g in groups.items() for t in g})
+        if len(merged) == len(terms):
+            return None
+        terms = merged
+    return [{field: t} for t in sorted(terms)]
+
+def merge_filtered(results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    One node's rows from several filtered queries, in time order; a message
+    matched by more than one filter (e.g. mail between two tenant domains) is kept once.
+    """
+    out, seen = [], set()
+    for items in results:
+        for it in items:
+            key = it.get("id")
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            out.append(it)
+    out.sort(key=lambda it: it.get("time") or 0)
+    return out
+
+
+class TrackerTruncated(Exception):
+    """
+    A tracker window holds more than PMG_TRACKER_LIMIT rows and cannot be split further.
+    """
+
+
+def tracker_query(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # an explicit limit: PMG's default (2000) would cut windows short without telling
+    return {"limit": PMG_TRACKER_LIMIT, **(params or {})}
+
+def capped(items: List[Dict[str, Any]], query: Dict[str, Any]) -> bool:
+    """
+    True if PMG returned as many rows as PMG_TRACKER_LIMIT allows, i.e. the window
+    may hold more. A limit the caller chose itself is taken as intended.
+    """
+    return int(query["limit"]) == PMG_TRACKER_LIMIT and len(items) >= PMG_TRACKER_LIMIT
+
+def split_window(host: str, node: str, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    The two halves of a capped window, or TrackerTruncated if it cannot be split.
+    """
+    start, end = query.get("starttime"), query.get("endtime")
+    if start is None or end is None or int(end) <= int(start):
+        raise TrackerTruncated(f"more than {PMG_TRACKER_LIMIT} tracker rows on {host}/{node} "
+                               f"between {start} and {end}")
+    mid = (int(start) + int(end)) // 2
+    return [{**query, "starttime": int(start), "endtime": mid}, {**query, "starttime": mid + 1, "endtime": int(end)}]
+
+def _fetch_tracker_window(host: str, node: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    query = tracker_query(params)
+    items = api_get(host, f"nodes/{node}/tracker", params=round_window(query)) or []
+    if capped(items, query):
+        return [it for half in split_window(host, node, query) for it in _fetch_tracker_window(host, node, half)]
+    # coalesced callers share row dicts; hand each one its own copies
+    return [dict(it) for it in in_window(items, query)]
+
+def get_tracker_for_node(host: str, node: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Query nodes/{node}/tracker on a specific host.
+    Windows longer than PMG_CHUNK_THRESHOLD are fetched as time chunks,
+    PMG_CHUNKS_PER_NODE at a time per node; a failed chunk is retried on its own.
+    """
+    chunks = TrackerChunks.plan(host, node, params)
+    if chunks is None:
+        return _fetch_tracker_window(host, node, params)
+
+    def worker():
+        while (chunk := chunks.claim()) is not None:
+            for attempt in range(PMG_CHUNK_RETRIES + 1):
+                try:
+                    with _chunk_semaphore(host, node):
+                        items = _fetch_tracker_window(host, node, chunks.params_for(chunk))
+                    break
+                except Exception as e:
+                    if not chunks.retry(chunk, attempt, e):
+                        raise
+            chunks.done(chunk, items)
+
+    # the calling thread works too; the others come from the chunk pool
+    futures = [_chunk_pool().submit(worker) for _ in range(PMG_CHUNKS_PER_NODE - 1)]
+    error = None
+    try:
+        worker()
+    except Exception as e:
+        error = e
+    for fut in futures:
+        try:
+            fut.result()
+        except Exception as e:
+            error = error or e
+    if error:
+        raise error
+    return chunks.stitch()
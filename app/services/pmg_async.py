@@ -0,0 +1,519 @@
+# app/services/pmg_async.py
+import os
+import time
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
+from . import pmg_api, pmg_health, pmg_limiter
+
+# HTTP/2 needs the optional "h2" package (httpx[http2]); fall back to HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+PMG_ASYNC_MAX_CONNECTIONS = int(os.getenv("PMG_ASYNC_MAX_CONNECTIONS", "50"))
+PMG_ASYNC_MAX_KEEPALIVE = int(os.getenv("PMG_ASYNC_MAX_KEEPALIVE", "20"))
+PMG_ASYNC_KEEPALIVE_EXPIRY = float(os.getenv("PMG_ASYNC_KEEPALIVE_EXPIRY", "60"))
+# concurrent nodes/{node}/tracker/{id} lookups per node
+PMG_DETAIL_PER_NODE = int(os.getenv("PMG_DETAIL_PER_NODE", "4"))
+# streamed bodies up to this size are read ahead in full, so a slow downloader
+# does not keep the host's limiter slot
+PMG_STREAM_BUFFER = int(os.getenv("PMG_STREAM_BUFFER", str(4 * 1024 * 1024)))
+# headers that describe the upstream encoding, not the decoded body handed on
+_ENCODING_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of pmg_api.SingleFlight: followers await the leader's future.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, asyncio.Future] = {}
+        self._stats = {"requests": 0, "upstream": 0, "shared": 0}
+
+    async def do(self, key, fn):
+        self._stats["requests"] += 1
+        fut = self._calls.get(key)
+        if fut is not None:
+            self._stats["shared"] += 1
+            # shield: one follower being cancelled must not cancel the shared call
+            return await asyncio.shield(fut)
+
+        self._stats["upstream"] += 1
+        fut = self._calls[key] = asyncio.ensure_future(fn())
+        fut.add_done_callback(lambda f: self._calls.pop(key, None))
+        # retrieve the exception even if every caller went away
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return await asyncio.shield(fut)
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self._stats)
+        out["coalescing_ratio"] = round(out["shared"] / out["requests"], 4) if out["requests"] else None
+        return out
+
+
+flights = AsyncSingleFlight()
+
+
+class _ReadAhead(httpx.AsyncByteStream):
+    """
+    Decoded body of an upstream response: the chunks already read, then the rest.
+    on_done() runs once the upstream body has been read to the end or closed.
+    """
+
+    def __init__(self, upstream: httpx.Response, head: List[bytes], rest: AsyncIterator[bytes],
+                 on_done: Callable[[], None]):
+        self.upstream, self.head, self.rest, self.on_done = upstream, head, rest, on_done
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while self.head:
+            yield self.head.pop(0)
+        async for chunk in self.rest:
+            yield chunk
+        self.on_done()
+
+    async def aclose(self):
+        await self.upstream.aclose()
+        self.on_done()
+
+
+class AsyncPMGClient:
+    """
+    asyncio-native client for one PMG host: a pooled keep-alive httpx.AsyncClient
+    plus a cached ticket that is renewed with the same rules as pmg_api.sessions.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self._client = httpx.AsyncClient(
+            base_url=f"https://{host}/api2/",
+            verify=pmg_api.PMG_VERIFY_SSL,
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(pmg_api.REQUEST_TIMEOUT, connect=pmg_health.PMG_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=PMG_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=PMG_ASYNC_MAX_KEEPALIVE,
+                keepalive_expiry=PMG_ASYNC_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._auth: Optional[Dict[str, Any]] = None
+        self._login_lock = asyncio.Lock()
+        self.stats = {"login_hits": 0, "login_misses": 0, "relogins_401": 0}
+
+    def _fresh(self, auth: Optional[Dict[str, Any]]) -> bool:
+        return auth is not None and time.monotonic() - auth["issued_at"] < pmg_api.PMG_TICKET_TTL
+
+    async def _login(self) -> Dict[str, Any]:
+        resp = await self._client.post("json/access/ticket", data={
+            "username": f"{pmg_api.PMG_USERNAME}@pmg",
+            "password": pmg_api.PMG_PASSWORD
+        })
+        resp.raise_for_status()
+        data = resp.json().get("data") or {}
+
+        ticket = data.get("ticket")
+        if not ticket:
+            raise ValueError("No PMG ticket returned on login")
+
+        headers = {"Cookie": f"PMGAuthCookie={ticket}"}
+        if data.get("CSRFPreventionToken"):
+            headers["CSRFPreventionToken"] = data["CSRFPreventionToken"]
+        return {"headers": headers, "issued_at": time.monotonic()}
+
+    async def _get_auth(self) -> Dict[str, Any]:
+        auth = self._auth
+        if self._fresh(auth):
+            self.stats["login_hits"] += 1
+            return auth
+
+        async with self._login_lock:
+            if self._fresh(self._auth):
+                self.stats["login_hits"] += 1
+                return self._auth
+            self._auth = await self._login()
+            self.stats["login_misses"] += 1
+            return self._auth
+
+    def _timeout(self, kind: str) -> httpx.Timeout:
+        return httpx.Timeout(pmg_health.get(self.host).timeout(kind), connect=pmg_health.PMG_CONNECT_TIMEOUT)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Send an authenticated request (path relative to api2/), re-logging in once on 401.
+        Goes through the host's circuit breaker and upstream limiter, with a latency-derived timeout.
+        """
+        health = pmg_health.get(self.host)
+        health.before_request()
+        span = pmg_health.window_span(path, kwargs.get("params"))
+        kind = pmg_health.request_kind(path, kwargs.get("params"))
+        kwargs.setdefault("timeout", self._timeout(kind))
+        extra_headers = kwargs.pop("headers", None) or {}
+
+        limiter = pmg_limiter.get(self.host)
+        try:
+            await limiter.acquire_async()
+        except asyncio.CancelledError:
+            health.abandon()
+            raise
+        started = time.monotonic()
+        try:
+            for attempt in range(2):
+                auth = await self._get_auth()
+                headers = {**extra_headers, **auth["headers"]}
+                r = await self._client.request(method, path, headers=headers, **kwargs)
+                if r.status_code != 401 or attempt:
+                    break
+
+                self.stats["relogins_401"] += 1
+                if self._auth is auth:
+                    self._auth = None
+        except asyncio.CancelledError:
+            limiter.release(kind, None)
+            health.abandon()
+            raise
+        except Exception as e:
+            limiter.release(kind, time.monotonic() - started)
+            if isinstance(e, httpx.ReadTimeout) and pmg_health.large_window(span):
+                # a long scan outgrowing its timeout says nothing about the host
+                health.abandon()
+            else:
+                health.record_failure()
+            raise
+
+        elapsed = time.monotonic() - started
+        limiter.release(kind, elapsed, r.status_code, pmg_limiter.retry_after(r.headers))
+        if r.status_code >= 500:
+            health.record_failure()
+        else:
+            health.record_success(kind, elapsed)
+        return r
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Like request(), but the body is not read: iterate resp.aiter_bytes() inside the block.
+        The breaker judges the host on the response headers. Up to PMG_STREAM_BUFFER
+        bytes are read ahead; the limiter slot is released as soon as PMG has sent
+        the whole body, not when the caller has consumed it.
+        """
+        health = pmg_health.get(self.host)
+        health.before_request()
+        span = pmg_health.window_span(path, kwargs.get("params"))
+        kind = pmg_health.request_kind(path, kwargs.get("params"))
+        kwargs.setdefault("timeout", self._timeout(kind))
+        extra_headers = kwargs.pop("headers", None) or {}
+
+        limiter = pmg_limiter.get(self.host)
+        try:
+            await limiter.acquire_async()
+        except asyncio.CancelledError:
+            health.abandon()
+            raise
+        started = time.monotonic()
+        try:
+            for attempt in range(2):
+                auth = await self._get_auth()
+                headers = {**extra_headers, **auth["headers"]}
+                req = self._client.build_request(method, path, headers=headers, **kwargs)
+                r = await self._client.send(req, stream=True)
+                if r.status_code != 401 or attempt:
+                    break
+                await r.aclose()
+                self.stats["relogins_401"] += 1
+                if self._auth is auth:
+                    self._auth = None
+        except asyncio.CancelledError:
+            limiter.release(kind, None)
+            health.abandon()
+            raise
+        except Exception as e:
+            limiter.release(kind, time.monotonic() - started)
+            if isinstance(e, httpx.ReadTimeout) and pmg_health.large_window(span):
+                # a long scan outgrowing its timeout says nothing about the host
+                health.abandon()
+            else:
+                health.record_failure()
+            raise
+
+        elapsed = time.monotonic() - started
+        if r.status_code >= 500:
+            health.record_failure()
+        else:
+            health.record_success(kind, elapsed)
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                limiter.release(kind, elapsed, r.status_code, pmg_limiter.retry_after(r.headers))
+
+        try:
+            head, size, rest = [], 0, r.aiter_bytes()
+            async for chunk in rest:
+                head.append(chunk)
+                size += len(chunk)
+                if size > PMG_STREAM_BUFFER:
+                    break
+            else:
+                await r.aclose()
+                release()
+            body = httpx.Response(r.status_code, request=r.request,
+                                  headers=[(k, v) for k, v in r.headers.multi_items() if k.lower() not in _ENCODING_HEADERS],
+                                  stream=_ReadAhead(r, head, rest, release))
+            yield body
+        finally:
+            await r.aclose()
+            release()
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        GET api2/json/{path} and return the "data" member.
+        Identical concurrent GETs share one upstream request.
+        """
+        async def fetch():
+            r = await self.request("GET", "json/" + path, params=params or {})
+            r.raise_for_status()
+            j = r.json()
+            return j.get("data") if isinstance(j, dict) else j
+
+        return await flights.do(pmg_api.flight_key(self.host, path, params), fetch)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_clients: Dict[str, AsyncPMGClient] = {}
+_node_semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+_chunk_semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+_global_semaphore: Optional[asyncio.Semaphore] = None
+_background_tasks = set()
+
+
+def client(host: str) -> AsyncPMGClient:
+    """
+    Return the shared async client for host (created on first use).
+    """
+    c = _clients.get(host)
+    if c is None:
+        c = _clients[host] = AsyncPMGClient(host)
+    return c
+
+async def close_all():
+    """
+    Close every pooled connection; called on application shutdown.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for c in clients:
+        await c.aclose()
+
+def stats() -> Dict[str, Any]:
+    out = {"http2": HTTP2_AVAILABLE, "coalescing": flights.stats(), "hosts": {}}
+    for host, c in _clients.items():
+        out["hosts"][host] = dict(c.stats)
+    return out
+
+
+def _node_semaphore(host: str, node: str) -> asyncio.Semaphore:
+    sem = _node_semaphores.get((host, node))
+    if sem is None:
+        sem = _node_semaphores[(host, node)] = asyncio.Semaphore(PMG_DETAIL_PER_NODE)
+    return sem
+
+def _chunk_semaphore(host: str, node: str) -> asyncio.Semaphore:
+    sem = _chunk_semaphores.get((host, node))
+    if sem is None:
+        sem = _chunk_semaphores[(host, node)] = asyncio.Semaphore(pmg_api.PMG_CHUNKS_PER_NODE)
+    return sem
+
+def _fanout_semaphore() -> asyncio.Semaphore:
+    global _global_semaphore
+    if _global_semaphore is None:
+        _global_semaphore = asyncio.Semaphore(pmg_api.PMG_FANOUT_WORKERS)
+    return _global_semaphore
+
+
+async def refresh_nodes(host: str) -> List[str]:
+    """
+    Re-read /nodes for host into pmg_api.node_cache, falling back to the last known list on error.
+    """
+    pmg_api.node_cache.begin_refresh(host)
+    try:
+        nodes = pmg_api.node_names(await client(host).get_json("nodes"))
+    except Exception as e:
+        return pmg_api.node_cache.fail(host, e)
+    pmg_api.node_cache.store(host, nodes)
+    return nodes
+
+async def _refresh_nodes_quietly(host: str):
+    try:
+        await refresh_nodes(host)
+    except Exception as e:
+        print(f"PMG node refresh failed on {host}: {e}")
+
+def _spawn(coro):
+    # keep a reference so the task is not garbage collected mid-flight
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def get_nodes(host: str) -> List[str]:
+    """
+    Node names for a single host, served from the shared node cache.
+    Raises pmg_health.HostUnavailable while the host's breaker is open.
+    """
+    pmg_health.check(host)
+    nodes, refresh = pmg_api.node_cache.serve(host)
+    if nodes is None:
+        return await refresh_nodes(host)
+    if refresh:
+        _spawn(_refresh_nodes_quietly(host))
+    return nodes
+
+async def _fetch_tracker_window(host: str, node: str, params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    query = pmg_api.tracker_query(params)
+    items = await client(host).get_json(f"nodes/{node}/tracker", params=pmg_api.round_window(query)) or []
+    if pmg_api.capped(items, query):
+        # cut short by the row limit: fetch both halves instead (see pmg_api._fetch_tracker_window)
+        halves = await asyncio.gather(*(_fetch_tracker_window(host, node, half)
+                                        for half in pmg_api.split_window(host, node, query)))
+        return [it for half in halves for it in half]
+    # coalesced callers share row dicts; hand each one its own copies
+    return [dict(it) for it in pmg_api.in_window(items, query)]
+
+async def get_tracker_for_node(host: str, node: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Query nodes/{node}/tracker on a specific host.
+    Long windows are fetched as time chunks like pmg_api.get_tracker_for_node.
+    """
+    chunks = pmg_api.TrackerChunks.plan(host, node, params)
+    if chunks is None:
+        return await _fetch_tracker_window(host, node, params)
+
+    async def worker():
+        while (chunk := chunks.claim()) is not None:
+            for attempt in range(pmg_api.PMG_CHUNK_RETRIES + 1):
+                try:
+                    async with _chunk_semaphore(host, node):
+                        items = await _fetch_tracker_window(host, node, chunks.params_for(chunk))
+                    break
+                except Exception as e:
+                    if not chunks.retry(chunk, attempt, e):
+                        raise
+            chunks.done(chunk, items)
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(pmg_api.PMG_CHUNKS_PER_NODE)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # one chunk gave up (or the caller went away): stop the rest
+        for t in tasks:
+            t.cancel()
+    return chunks.stitch()
+
+async def _get_tracker_batch(host: str, node: str, params: Optional[Dict[str, Any]],
+                             filters: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+    # per-host pressure is governed by pmg_limiter inside AsyncPMGClient.request
+    async with _fanout_semaphore():
+        if filters:
+            results = await asyncio.gather(
+                *(get_tracker_for_node(host, node, params={**(params or {}), **f}) for f in filters))
+            items = pmg_api.merge_filtered(results)
+        else:
+            items = await get_tracker_for_node(host, node, params=params)
+    for it in items:
+        it["_pmg_host"] = host
+        it["_pmg_node"] = node
+    return items
+
+async def _plan_tracker(stable: bool = False) -> Tuple[List[Tuple[str, str]], List[Dict[str, Any]]]:
+    hosts = pmg_api.PMG_HOSTS
+    node_lists, failures = {}, {}
+    for host, nodes in zip(hosts, await asyncio.gather(*(get_nodes(h) for h in hosts), return_exceptions=True)):
+        if isinstance(nodes, BaseException):
+            failures[host] = str(nodes)
+        else:
+            node_lists[host] = nodes
+    return pmg_api.plan_tracker(node_lists, failures, stable=stable)
+
+async def get_tracker_detail(host: str, node: str, id: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Query nodes/{node}/tracker/{id} (the per-message log), PMG_DETAIL_PER_NODE at a time per node.
+    """
+    async with _fanout_semaphore(), _node_semaphore(host, node):
+        # both segments are quoted so they can never add path components
+        data = await client(host).get_json(f"nodes/{quote(node, safe='')}/tracker/{quote(id, safe='')}", params=params)
+    # coalesced callers share the dict
+    return dict(data) if isinstance(data, dict) else {"data": data}
+
+async def fetch_all_tracker(params: Optional[Dict[str, Any]] = None,
+                            filters: Optional[List[Dict[str, str]]] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Fetch tracker data from all nodes across all hosts concurrently, each node once per cluster.
+    Returns (items, errors) merged in cluster / node order; errors holds one entry per failed host or node.
+    With filters (see pmg_api.plan_filters) each node runs one query per filter instead of a full scan.
+    """
+    query_params = params if params else None
+    targets, errors = await _plan_tracker()
+
+    batches = await asyncio.gather(
+        *(_get_tracker_batch(h, n, query_params, filters) for h, n in targets),
+        return_exceptions=True
+    )
+
+    all_items = []
+    for (host, node), items in zip(targets, batches):
+        if isinstance(items, BaseException):
+            errors.append({"host": host, "node": node, "error": str(items)})
+            continue
+        all_items.extend(items)
+
+    return all_items, errors
+
+async def iter_tracker_batches(params: Optional[Dict[str, Any]] = None,
+                               filters: Optional[List[Dict[str, str]]] = None,
+                               progress: Optional[Callable[[int, int], None]] = None,
+                               stable: bool = False) -> AsyncIterator[Tuple[Optional[str], Optional[str], List[Dict[str, Any]], Optional[str]]]:
+    """
+    Yield (host, node, items, error) for each node as soon as it answers, in completion order.
+    Every node is asked once per cluster. A host whose node list failed (and no
+    other member of its cluster answered) is reported once with node=None; nodes
+    only that host was known to have are reported each with their node name.
+    filters works as in fetch_all_tracker; progress(total_delta, done_delta) counts nodes.
+    stable=True asks each node through the same member every time (see pmg_api.plan_tracker),
+    which paged callers need.
+    """
+    query_params = params if params else None
+
+    async def node_batch(host, node):
+        try:
+            return host, node, await _get_tracker_batch(host, node, query_params, filters), None
+        except Exception as e:
+            return host, node, [], str(e)
+
+    # node lists come from the node cache, so planning up front costs next to nothing
+    targets, errors = await _plan_tracker(stable)
+    if progress:
+        progress(len(targets) + len(errors), len(errors))
+    for err in errors:
+        yield err["host"], err.get("node"), [], err["error"]
+
+    tasks = [asyncio.ensure_future(node_batch(h, n)) for h, n in targets]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            batch = await fut
+            if progress:
+                progress(0, 1)
+            yield batch
+    finally:
+        # client went away mid-stream: don't leave node fetches running
+        for t in tasks:
+            t.cancel()
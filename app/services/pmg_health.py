@@ -0,0 +1,225 @@
+# app/services/pmg_health.py
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+PMG_BREAKER_FAILURES = int(os.getenv("PMG_BREAKER_FAILURES", "5"))
+PMG_BREAKER_COOLDOWN = int(os.getenv("PMG_BREAKER_COOLDOWN", "30"))
+PMG_TIMEOUT_MIN = float(os.getenv("PMG_TIMEOUT_MIN", "2"))
+PMG_TIMEOUT_MAX = float(os.getenv("PMG_REQ_TIMEOUT", "20"))
+# a host that is down usually fails at connect; don't wait the full timeout for that
+PMG_CONNECT_TIMEOUT = float(os.getenv("PMG_CONNECT_TIMEOUT", "5"))
+# timeout = multiplier x observed p99 latency for that kind of request
+PMG_TIMEOUT_MULTIPLIER = float(os.getenv("PMG_TIMEOUT_MULTIPLIER", "3"))
+PMG_TIMEOUT_MIN_SAMPLES = int(os.getenv("PMG_TIMEOUT_MIN_SAMPLES", "20"))
+PMG_PROBE_INTERVAL = int(os.getenv("PMG_PROBE_INTERVAL", "10"))
+# windowed queries (tracker, quarantine) are timed per window length class: the frequent
+# short sync polls must not set the timeout for full-day scans
+PMG_WINDOW_CLASSES = [int(s) for s in os.getenv("PMG_WINDOW_CLASSES", "3600,21600,86400").split(",")]
+# read timeouts on windows longer than this (or open-ended) do not count toward the breaker
+PMG_LARGE_WINDOW = int(os.getenv("PMG_LARGE_WINDOW", "3600"))
+
+# endpoints whose cost grows with their starttime/endtime window; PMG defaults to today without one
+WINDOWED_KINDS = ("tracker", "spam", "spamusers")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class HostUnavailable(Exception):
+    """
+    Raised instead of calling a host whose circuit breaker is open.
+    """
+
+
+def _endpoint(path: str) -> str:
+    parts = [p for p in path.split("?")[0].rstrip("/").split("/") if p]
+    if not parts:
+        return ""
+    last = parts[-1]
+    if last.isalpha() or len(parts) == 1:
+        return last
+    return parts[-2] + "/*"
+
+def window_span(path: str, params: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """
+    Seconds a windowed query covers (inf when open-ended), None for other requests.
+    """
+    if _endpoint(path) not in WINDOWED_KINDS:
+        return None
+    params = params or {}
+    if params.get("starttime") is None:
+        return float("inf")
+    end = params.get("endtime")
+    return (float(end) if end is not None else time.time()) - float(params["starttime"])
+
+def large_window(span: Optional[float]) -> bool:
+    return span is not None and span > PMG_LARGE_WINDOW
+
+def request_kind(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Group latencies by endpoint, not by node name or message id:
+    ".../nodes/pmg1/tracker" -> "tracker", ".../tracker/C1R2" -> "tracker/*".
+    Windowed queries also by window length: "tracker<=3600", "tracker>86400".
+    """
+    kind = _endpoint(path)
+    span = window_span(path, params)
+    if span is None:
+        return kind
+    for limit in PMG_WINDOW_CLASSES:
+        if span <= limit:
+            return f"{kind}<={limit}"
+    return f"{kind}>{PMG_WINDOW_CLASSES[-1]}"
+
+
+class HostHealth:
+    """
+    Circuit breaker (closed -> open after PMG_BREAKER_FAILURES consecutive
+    failures -> half-open after PMG_BREAKER_COOLDOWN -> closed on one success)
+    plus latency samples per request kind for adaptive timeouts.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.latency: Dict[str, deque] = {}
+        self.totals = {"success": 0, "failure": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Admit a request or raise HostUnavailable. In half-open only one trial runs at a time.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= PMG_BREAKER_COOLDOWN:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            self.totals["rejected"] += 1
+        raise HostUnavailable(f"PMG host {self.host} is unavailable (circuit {self.state})")
+
+    def available(self) -> bool:
+        """
+        False while requests would be rejected: open and cooling down, or a half-open trial running.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= PMG_BREAKER_COOLDOWN
+            return not (self.state == HALF_OPEN and self.trial_in_flight)
+
+    def abandon(self):
+        """
+        The admitted request was cancelled: neither success nor failure, but free the trial slot.
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self, kind: str, seconds: float):
+        with self._lock:
+            self.totals["success"] += 1
+            self.failures = 0
+            self.state = CLOSED
+            self.trial_in_flight = False
+            self.latency.setdefault(kind, deque(maxlen=200)).append(seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.totals["failure"] += 1
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= PMG_BREAKER_FAILURES:
+                if self.state != OPEN:
+                    print(f"PMG circuit for {self.host} opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def p(self, kind: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latency.get(kind) or ())
+        if len(samples) < PMG_TIMEOUT_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self, kind: str) -> float:
+        p99 = self.p(kind, 0.99)
+        if p99 is None:
+            return PMG_TIMEOUT_MAX
+        return max(PMG_TIMEOUT_MIN, min(PMG_TIMEOUT_MAX, p99 * PMG_TIMEOUT_MULTIPLIER))
+
+    def median_latency(self) -> Optional[float]:
+        with self._lock:
+            samples = sorted(s for d in self.latency.values() for s in d)
+        return samples[len(samples) // 2] if samples else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            kinds = list(self.latency)
+            out = {"state": self.state, "consecutive_failures": self.failures, **self.totals}
+        out["timeouts"] = {k: round(self.timeout(k), 3) for k in kinds}
+        out["p50"] = {k: self.p(k, 0.5) for k in kinds}
+        out["p99"] = {k: self.p(k, 0.99) for k in kinds}
+        return out
+
+
+_hosts: Dict[str, HostHealth] = {}
+_lock = threading.Lock()
+_probe_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def get(host: str) -> HostHealth:
+    with _lock:
+        h = _hosts.get(host)
+        if h is None:
+            h = _hosts[host] = HostHealth(host)
+        return h
+
+def check(host: str):
+    """
+    Raise HostUnavailable for a host callers should skip right now.
+    """
+    h = get(host)
+    if not h.available():
+        raise HostUnavailable(f"PMG host {host} is unavailable (circuit {h.state})")
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        hosts = list(_hosts.values())
+    return {h.host: h.snapshot() for h in hosts}
+
+
+def _probe_loop(probe: Callable[[str], Any]):
+    while not _stop.wait(PMG_PROBE_INTERVAL):
+        with _lock:
+            hosts = [h for h in _hosts.values() if h.state != CLOSED]
+        for h in hosts:
+            if time.monotonic() - h.opened_at < PMG_BREAKER_COOLDOWN:
+                continue
+            try:
+                # goes through before_request(), i.e. becomes the half-open trial
+                probe(h.host)
+                print(f"PMG host {h.host} recovered")
+            except Exception:
+                pass
+
+def start_probe(probe: Callable[[str], Any]):
+    """
+    Background recovery check for hosts whose breaker is open; probe(host) must
+    perform a cheap request through the breaker.
+    """
+    global _probe_thread
+    if _probe_thread and _probe_thread.is_alive():
+        return
+    _stop.clear()
+    _probe_thread = threading.Thread(target=_probe_loop, args=(probe,), name="pmg-probe", daemon=True)
+    _probe_thread.start()
+
+def stop_probe():
+    _stop.set()
@@ -0,0 +1,164 @@
+# app/services/pmg_limiter.py
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from . import pmg_health
+
+# token bucket: requests per second per host (adapted between MIN and MAX) and burst size
+PMG_RATE_INITIAL = float(os.getenv("PMG_RATE_INITIAL", "20"))
+PMG_RATE_MIN = float(os.getenv("PMG_RATE_MIN", "2"))
+PMG_RATE_MAX = float(os.getenv("PMG_RATE_MAX", "100"))
+PMG_BURST = float(os.getenv("PMG_BURST", "20"))
+# concurrent requests per host (adapted between MIN and MAX)
+PMG_LIMIT_INITIAL = float(os.getenv("PMG_LIMIT_INITIAL", "4"))
+PMG_LIMIT_MIN = float(os.getenv("PMG_LIMIT_MIN", "1"))
+PMG_LIMIT_MAX = float(os.getenv("PMG_LIMIT_MAX", "32"))
+# a response slower than this multiple of the host's median for that request kind counts as congestion
+PMG_LATENCY_TOLERANCE = float(os.getenv("PMG_LATENCY_TOLERANCE", "3"))
+# decreases closer together than this are one congestion event
+PMG_BACKOFF_INTERVAL = float(os.getenv("PMG_BACKOFF_INTERVAL", "1"))
+
+
+class HostLimiter:
+    """
+    Upstream limiter for one PMG host: a token bucket plus a concurrency limit,
+    both adjusted AIMD-style. Every good response adds 1/limit to the limit
+    (about +1 per round trip); 429/5xx halve limit and rate, slow responses cut
+    them by a quarter. Usable from threads (acquire) and asyncio (acquire_async).
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.limit = PMG_LIMIT_INITIAL
+        self.rate = PMG_RATE_INITIAL
+        self.tokens = PMG_BURST
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.stats = {"acquired": 0, "waited": 0, "increases": 0, "decreases": 0, "throttled": 0}
+
+    def _try(self) -> Optional[float]:
+        """
+        Under the lock: take a slot and a token and return 0, or return how long to
+        wait for a token (None: wait for a slot to be released).
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        self.tokens = min(PMG_BURST, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        self.stats["acquired"] += 1
+        return 0
+
+    def acquire(self):
+        with self._cond:
+            wait = self._try()
+            if wait:
+                self.stats["waited"] += 1
+            while wait != 0:
+                self._cond.wait(wait)
+                wait = self._try()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        counted = False
+        while True:
+            with self._lock:
+                wait = self._try()
+                if wait == 0:
+                    return
+                if not counted:
+                    self.stats["waited"] += 1
+                    counted = True
+                fut = loop.create_future()
+                self._async_waiters.append((loop, fut))
+            try:
+                await asyncio.wait_for(fut, timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    if (loop, fut) in self._async_waiters:
+                        self._async_waiters.remove((loop, fut))
+
+    def _wake(self):
+        # under the lock: let every waiter re-check (there are few, and most go back to sleep)
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease < PMG_BACKOFF_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(PMG_LIMIT_MIN, self.limit * factor)
+        self.rate = max(PMG_RATE_MIN, self.rate * factor)
+        self.stats["decreases"] += 1
+
+    def release(self, kind: str, seconds: Optional[float], status: Optional[int] = None,
+                retry_after: Optional[float] = None):
+        """
+        Return the slot. status is the HTTP status (None: transport error,
+        seconds=None: cancelled, which does not count either way).
+        """
+        median = pmg_health.get(self.host).p(kind, 0.5) if seconds is not None else None
+        with self._lock:
+            self.in_flight -= 1
+            if seconds is None:
+                pass
+            elif status == 429 or status is None or status >= 500:
+                if status == 429:
+                    self.stats["throttled"] += 1
+                    if retry_after:
+                        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self._decrease(0.5)
+            elif median and seconds > median * PMG_LATENCY_TOLERANCE:
+                self._decrease(0.75)
+            else:
+                self.limit = min(PMG_LIMIT_MAX, self.limit + 1 / self.limit)
+                self.rate = min(PMG_RATE_MAX, self.rate + 1 / self.limit)
+                self.stats["increases"] += 1
+            self._wake()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"limit": round(self.limit, 2), "rate": round(self.rate, 2), "in_flight": self.in_flight,
+                    "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2), **self.stats}
+
+
+def retry_after(headers) -> Optional[float]:
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters: Dict[str, HostLimiter] = {}
+_lock = threading.Lock()
+
+
+def get(host: str) -> HostLimiter:
+    with _lock:
+        lim = _limiters.get(host)
+        if lim is None:
+            lim = _limiters[host] = HostLimiter(host)
+        return lim
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        limiters = list(_limiters.values())
+    return {lim.host: lim.snapshot() for lim in limiters}
@@ -1,11 +1,19 @@
 # app/services/pmg_spam.py
-import time
-from typing import List, Dict, Any
-from . import pmg_api
-from app.services.client_domains import get_domains_for_client
-import time
+import heapq
+import logging
+import asyncio
+import itertools
+from typing import Callable, List, Dict, Any
+from . import pmg_api, pmg_async, pmg_health, spam_cache, spam_stats
+from app.services.client_domains import get_matcher_for_client
+from app.services.domain_matcher import DomainMatcher, domain_of
+import os
 from typing import Optional
-from fastapi import Query
+
+log = logging.getLogger(__name__)
+
+# /quarantine/spam?pmail= fetches in flight per host and request; pmg_limiter decides how many reach PMG
+PMG_SPAM_PER_HOST = int(os.getenv("PMG_SPAM_PER_HOST", "8"))
 
 def normalize_user_email(u: Any) -> str | None:
     """
@@ -22,110 +30,200 @@ def normalize_user_email(u: Any) -> str | None:
                 return v.lower()
     return None
 
-def email_matches_domains(email: str, domains: List[str]) -> bool:
+def email_matches_domains(email: str, domains: DomainMatcher) -> bool:
     if not email or "@" not in email:
         return False
-    domain = email.split("@", 1)[1].lower()
-    return domain in domains
+    return domains.match_domain(domain_of(email))
+
+def newest_first(m: Dict) -> tuple:
+    # sort key for quarantine results: newest first, ties broken by (canonical) host and id;
+    # the member a cluster is read through can change between pages
+    host = m.get("_pmg_host")
+    return (-(m.get("time") or 0), pmg_api.canonical_host(host) if host else "", str(m.get("id", "")))
+
+async def _fetch_mailbox(client, host: str, user_email: str, starttime: int, endtime: int) -> List[Dict]:
+    # get_json coalesces identical in-flight queries (e.g. the same mailbox from two sessions)
+    messages = await client.get_json(
+        "quarantine/spam",
+        params={
+            "starttime": starttime,
+            "endtime": endtime,
+            "pmail": user_email
+        }
+    ) or []
+
+    out = []
+    for m in messages:
+        # annotate for traceability (copies: coalesced callers share the upstream dicts)
+        out.append({**m, "_pmg_host": host, "_pmg_email": user_email})
+
+    # feed the statistics rollup with what was just fetched
+    try:
+        await asyncio.to_thread(spam_stats.record, pmg_api.canonical_host(host), user_email, messages)
+    except Exception as e:
+        # statistics are best effort; don't flood the output once per mailbox
+        log.debug("Spam stats update failed for %s on %s: %s", user_email, host, e)
+    return out
+
+async def _get_host_spam(host: str, allowed_domains: DomainMatcher, starttime: int, endtime: int,
+                         errors: List[Dict], progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+    # a host whose breaker is open is skipped outright
+    pmg_health.check(host)
+    client = pmg_async.client(host)
+
+    async def fetch_users(start: int, end: int) -> List[str]:
+        # STEP 1: fetch spam users (pooled connection, cached PMG ticket)
+        users = await client.get_json(
+            "quarantine/spamusers",
+            params={
+                "starttime": start,
+                "endtime": end,
+                "quarantine-type": "spam"
+            }
+        ) or []
+
+        # normalize to list of email strings
+        normalized_users: List[str] = []
+        for u in users:
+            em = normalize_user_email(u)
+            if em:
+                normalized_users.append(em)
+        return normalized_users
+
+    # only the slice since the last listing is fetched when the cache is warm;
+    # keyed by cluster, so switching to another member keeps the cache
+    cache_host = pmg_api.canonical_host(host)
+    normalized_users = await spam_cache.cache.users(cache_host, starttime, endtime, fetch_users)
+
+    # filter by allowed domains; sorted so dispatch order is stable
+    filtered_users = sorted(set(em for em in normalized_users if email_matches_domains(em, allowed_domains)))
+    if progress:
+        progress(len(filtered_users), 0)
+
+    # STEP 2: fetch messages for each allowed email, PMG_SPAM_PER_HOST at a time
+    results: List[Optional[List[Dict]]] = [None] * len(filtered_users)
+    pending = iter(range(len(filtered_users)))
+    # kept local until the host is done: if it fails, the next cluster member starts over
+    host_errors: List[Dict] = []
+    done = {"mailboxes": 0}
+    unavailable: List[Exception] = []
+
+    async def worker():
+        for idx in pending:
+            if unavailable:
+                return
+            user_email = filtered_users[idx]
+            try:
+                messages = await spam_cache.cache.messages(
+                    cache_host, user_email, starttime, endtime,
+                    lambda start, end: _fetch_mailbox(client, host, user_email, start, end)
+                )
+            except pmg_health.HostUnavailable as e_inner:
+                # breaker opened mid-way: the remaining mailboxes would be rejected too
+                unavailable.append(e_inner)
+                return
+            except Exception as e_inner:
+                print(f"Error fetching spam for {user_email} on host {host}: {e_inner}")
+                host_errors.append({"host": host, "mailbox": user_email, "error": str(e_inner)})
+                messages = None
+            results[idx] = messages
+            done["mailboxes"] += 1
+            if progress:
+                progress(0, 1)
+
+    await asyncio.gather(*(worker() for _ in range(min(PMG_SPAM_PER_HOST, len(filtered_users)))))
+
+    if unavailable:
+        # hand over to the next member of the cluster as if this host had not been asked
+        if progress:
+            progress(-len(filtered_users), -done["mailboxes"])
+        raise unavailable[0]
+    errors.extend(host_errors)
+    return [m for messages in results if messages for m in messages]
+
+async def _get_cluster_spam(members: List[str], allowed_domains: DomainMatcher, starttime: int, endtime: int,
+                            errors: List[Dict], progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+    """
+    The quarantine is replicated across a PMG cluster: read it from one member,
+    the preferred (healthy, fastest) one, falling back to the next on failure.
+    """
+    last_error: Optional[Exception] = None
+    for host in pmg_api.preferred(members):
+        try:
+            return await _get_host_spam(host, allowed_domains, starttime, endtime, errors, progress)
+        except Exception as e:
+            print(f"Error fetching spam for host {host}: {e}")
+            last_error = e
+    raise last_error
 
-def get_spam_quarantine(client_id: int, starttime: int = None, endtime: int = None) -> List[Dict]:
+async def get_spam_quarantine(client_id: int, starttime: int = None, endtime: int = None,
+                              limit: Optional[int] = None, errors: Optional[List[Dict]] = None,
+                              progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
     """
     Fetch spam quarantine messages only for the domains the client owns.
-    Returns a flat list of message dicts, each augmented with _pmg_host and _pmg_email.
+    Returns a flat list of message dicts, newest first, each augmented with
+    _pmg_host and _pmg_email.
+
+    Clusters are queried concurrently, each through one member (see pmg_api.clusters),
+    and mailboxes PMG_SPAM_PER_HOST at a time per host.
+    With `limit`, the newest `limit` messages of all mailboxes are returned: every
+    mailbox is read (the listings are cached, see spam_cache) and the cut is made
+    after the merge.
+
+    Hosts or mailboxes that could not be read (e.g. breaker open) are appended
+    to `errors` when given, so callers can mark the result partial.
+    progress(total_delta, done_delta), when given, counts mailboxes as they are listed and fetched.
     """
-
-    # now = int(time.time())
-
-    # starttime: Optional[int] = Query(None, description="Unix epoch start time for spam query")
-    # endtime: Optional[int] = Query(None, description="Unix epoch end time for spam query")
-
-    # if starttime is None or starttime < 0:
-    #     starttime = now - 86400  # 1 day ago
-    # if endtime is None or endtime < 0:
-    #     endtime = now
-    # if starttime is None:
-    #     starttime = int(time.time()) - 86400000000
-    # if endtime is None:
-    #     endtime = int(time.time())
+    if errors is None:
+        errors = []
 
     # obtain allowed domains for this client
-    allowed_domains = get_domains_for_client(client_id)
-    allowed_domains = [d.lower() for d in allowed_domains]
-    print("CLIENT DOMAINS:", allowed_domains)
-
-    all_spam: List[Dict] = []
-
-    for host in pmg_api.PMG_HOSTS:
-        try:
-            sess_info = pmg_api.login_and_get_session(host)
-            session = sess_info["session"]
-            csrf = sess_info.get("csrf")
-
-            headers = {}
-            if csrf:
-                headers["CSRFPreventionToken"] = csrf
-
-            # STEP 1: fetch spam users
-            resp_users = session.get(
-                f"https://{host}/api2/json/quarantine/spamusers",
-                params={
-                    "starttime": starttime,
-                    "endtime": endtime,
-                    "quarantine-type": "spam"
-                },
-                headers=headers,
-                timeout=pmg_api.REQUEST_TIMEOUT
-            )
-            resp_users.raise_for_status()
-            raw_users = resp_users.json()
-            print(f"RAW USERS FROM {host}:", raw_users)
-            users = raw_users.get("data", []) if isinstance(raw_users, dict) else raw_users
-
-            # normalize to list of email strings
-            normalized_users: List[str] = []
-            for u in users:
-                em = normalize_user_email(u)
-                if em:
-                    normalized_users.append(em)
-            print(f"NORMALIZED USERS FROM {host}:", normalized_users)
-
-            # filter by allowed domains
-            filtered_users = [em for em in normalized_users if email_matches_domains(em, allowed_domains)]
-            print(f"FILTERED USERS FOR CLIENT ON {host}:", filtered_users)
-
-            # STEP 2: fetch messages for each allowed email
-            for user_email in filtered_users:
-                try:
-                    resp_spam = session.get(
-                        f"https://{host}/api2/json/quarantine/spam",
-                        params={
-                            "starttime": starttime,
-                            "endtime": endtime,
-                            "pmail": user_email
-                        },
-                        headers=headers,
-                        timeout=pmg_api.REQUEST_TIMEOUT
-                    )
-                    resp_spam.raise_for_status()
-                    j = resp_spam.json()
-                    messages = j.get("data", []) if isinstance(j, dict) else j
-
-                    for m in messages:
-                        # annotate for traceability
-                        m["_pmg_host"] = host
-                        m["_pmg_email"] = user_email
-                        all_spam.append(m)
-
-                except Exception as e_inner:
-                    print(f"Error fetching spam for {user_email} on host {host}: {e_inner}")
-                    # continue to next email
-                    continue
-
-            # small throttle so we don't hammer PMG across nodes/hosts
-            time.sleep(0.05)
-
-        except Exception as e:
-            print(f"Error fetching spam for host {host}: {e}")
+    # off the event loop: a cache miss borrows a pooled DB connection
+    allowed_domains = await asyncio.to_thread(get_matcher_for_client, client_id)
+
+    groups = pmg_api.clusters()
+    per_cluster = await asyncio.gather(
+        *(_get_cluster_spam(members, allowed_domains, starttime, endtime, errors, progress)
+          for members in groups),
+        return_exceptions=True
+    )
+
+    host_lists: List[List[Dict]] = []
+    for members, res in zip(groups, per_cluster):
+        if isinstance(res, BaseException):
+            errors.append({"host": ",".join(members), "error": str(res)})
             continue
+        host_lists.append(sorted(res, key=newest_first))
+
+    # k-way merge of the per-cluster lists
+    merged = heapq.merge(*host_lists, key=newest_first)
+    if limit:
+        return list(itertools.islice(merged, limit))
+    return list(merged)
 
-    return all_spam
+async def get_spam_page(client_id: int, starttime: int, endtime: int, page_size: int,
+                        after: Optional[tuple] = None, errors: Optional[List[Dict]] = None) -> List[Dict]:
+    """
+    One page of the client's quarantine, newest first, following the cursor
+    position `after` (time, host, node, id). The window is cut at the cursor's
+    time and walked backwards in growing slices (pmg_api.page_windows) until a
+    slice leaves page_size messages: older slices can only hold older messages.
+    """
+    if errors is None:
+        errors = []
+    after_key = None
+    if after:
+        endtime = min(endtime, after[0])
+        after_key = (-after[0], after[1], after[3])
+
+    page: List[Dict] = []
+    for lo, hi in pmg_api.page_windows(starttime, endtime, newest_first=True):
+        slice_errors: List[Dict] = []
+        items = await get_spam_quarantine(client_id=client_id, starttime=lo, endtime=hi, errors=slice_errors)
+        errors.extend(e for e in slice_errors if e not in errors)
+        if after_key is not None:
+            items = [m for m in items if newest_first(m) > after_key]
+        page.extend(items[:page_size - len(page)])
+        if len(page) >= page_size:
+            break
+    return page
@@ -0,0 +1,202 @@
+# app/services/provisioning.py
+import os
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils import security
+from app.services.client_domains import invalidate_client
+
+BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 2)))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "50000"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _hash(password: str) -> str:
+    # module-level so it can be sent to the worker processes
+    return security.hash_password(password)
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """
+    bcrypt is CPU-bound and holds the GIL: hash on a process pool, BULK_HASH_WORKERS wide.
+    """
+    global _pool
+    if len(passwords) < 4:
+        return [_hash(p) for p in passwords]
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: a forked child of this threaded server can inherit locks held by other threads
+            _pool = ProcessPoolExecutor(max_workers=BULK_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    chunk = max(1, len(passwords) // (BULK_HASH_WORKERS * 4))
+    return list(_pool.map(_hash, passwords, chunksize=chunk))
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def domain_error(domain: str) -> Optional[str]:
+    # same rules as POST /domains/{client_id}/domains
+    if not domain:
+        return "Empty domain"
+    if " " in domain or domain.count(".") < 1:
+        return "Invalid domain format"
+    return None
+
+def _existing(db: sqlite3.Connection, table: str, column: str, values: List[str]) -> set:
+    found = set()
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        rows = db.execute(
+            f"SELECT {column} FROM {table} WHERE {column} IN ({','.join('?' for _ in chunk)})", chunk
+        ).fetchall()
+        found.update(r[0] for r in rows)
+    return found
+
+def _text(row: Dict[str, Any], key: str) -> str:
+    v = row.get(key)
+    return "" if v is None else str(v).strip()
+
+
+def provision(db: sqlite3.Connection, clients: List[Dict[str, Any]], users: List[Dict[str, Any]],
+              domains: List[Dict[str, Any]], all_or_nothing: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Validate every row first, then insert all valid clients, users and domains
+    with executemany in one transaction. Users and domains name their client by
+    client_id or by name (which may be a client created in the same import).
+    Returns a per-row report; with all_or_nothing nothing is written if any row is invalid.
+    """
+    report: List[Dict[str, Any]] = []
+
+    def reject(kind, index, error):
+        report.append({"kind": kind, "row": index, "status": "error", "error": error})
+
+    known_names = {r["name"]: r["id"] for r in db.execute("SELECT id, name FROM clients")}
+    known_ids = set(known_names.values())
+
+    # clients
+    new_clients: List[Tuple[int, str]] = []
+    for i, row in enumerate(clients):
+        name = _text(row, "name")
+        if not name:
+            reject("client", i, "Empty name")
+        elif name in known_names:
+            reject("client", i, "Client already exists")
+        elif any(name == n for _, n in new_clients):
+            reject("client", i, "Duplicate in import")
+        else:
+            new_clients.append((i, name))
+    new_names = {n for _, n in new_clients}
+
+    def client_ref(row) -> Tuple[Optional[Any], Optional[str]]:
+        cid, name = _text(row, "client_id"), _text(row, "client")
+        if cid:
+            if not cid.isdigit() or int(cid) not in known_ids:
+                return None, "Client not found"
+            return int(cid), None
+        if name:
+            if name in known_names:
+                return known_names[name], None
+            if name in new_names:
+                return name, None  # resolved to an id after the clients are inserted
+            return None, "Client not found"
+        return None, "client_id or client is required"
+
+    # users
+    usernames = [_text(r, "username") for r in users]
+    taken = _existing(db, "client_users", "username", [u for u in usernames if u])
+    new_users: List[Tuple[int, Any, str, str]] = []
+    seen_users = set()
+    for i, row in enumerate(users):
+        username, password = usernames[i], row.get("password") or ""
+        ref, err = client_ref(row)
+        if err:
+            reject("user", i, err)
+        elif not username:
+            reject("user", i, "Empty username")
+        elif not password:
+            reject("user", i, "Empty password")
+        elif username in taken:
+            reject("user", i, "Username already exists")
+        elif username in seen_users:
+            reject("user", i, "Duplicate in import")
+        else:
+            seen_users.add(username)
+            new_users.append((i, ref, username, password))
+
+    # domains
+    names = [_text(r, "domain").lower() for r in domains]
+    taken = _existing(db, "domains", "domain", [d for d in names if d])
+    new_domains: List[Tuple[int, Any, str]] = []
+    seen_domains = set()
+    for i, row in enumerate(domains):
+        domain = names[i]
+        ref, err = client_ref(row)
+        err = err or domain_error(domain)
+        if err:
+            reject("domain", i, err)
+        elif domain in taken:
+            reject("domain", i, "Domain already exists")
+        elif domain in seen_domains:
+            reject("domain", i, "Duplicate in import")
+        else:
+            seen_domains.add(domain)
+            new_domains.append((i, ref, domain))
+
+    errors = len(report)
+    if dry_run or (all_or_nothing and errors):
+        status = "valid" if dry_run else "skipped"
+        report += [{"kind": "client", "row": i, "status": status} for i, _ in new_clients]
+        report += [{"kind": "user", "row": i, "status": status} for i, *_ in new_users]
+        report += [{"kind": "domain", "row": i, "status": status} for i, *_ in new_domains]
+        return _summary(report, errors, written=False)
+
+    hashed = hash_passwords([p for *_, p in new_users])
+    tokens = [security.generate_token() for _ in new_users]
+
+    try:
+        db.executemany("INSERT INTO clients (name) VALUES (?)", [(n,) for _, n in new_clients])
+        ids = dict(known_names)
+        if new_clients:
+            ids.update({r["name"]: r["id"] for r in db.execute(
+                f"SELECT id, name FROM clients WHERE name IN ({','.join('?' for _ in new_clients)})",
+                [n for _, n in new_clients])})
+
+        def cid(ref):
+            return ids[ref] if isinstance(ref, str) else ref
+
+        db.executemany("""
+            INSERT INTO client_users (client_id, username, password, token, role)
+            VALUES (?, ?, ?, ?, 'client')
+        """, [(cid(ref), u, h, t) for (_, ref, u, _), h, t in zip(new_users, hashed, tokens)])
+        db.executemany("INSERT INTO domains (client_id, domain) VALUES (?, ?)",
+                       [(cid(ref), d) for _, ref, d in new_domains])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for client_id in {cid(ref) for _, ref, _ in new_domains}:
+        invalidate_client(client_id)
+
+    report += [{"kind": "client", "row": i, "status": "created", "id": ids[n]} for i, n in new_clients]
+    report += [{"kind": "user", "row": i, "status": "created", "client_id": cid(ref), "username": u, "token": t}
+               for (i, ref, u, _), t in zip(new_users, tokens)]
+    report += [{"kind": "domain", "row": i, "status": "created", "client_id": cid(ref), "domain": d}
+               for i, ref, d in new_domains]
+    return _summary(report, errors, written=True)
+
+def _summary(report: List[Dict[str, Any]], errors: int, written: bool) -> Dict[str, Any]:
+    order = {"client": 0, "user": 1, "domain": 2}
+    report.sort(key=lambda r: (order[r["kind"]], r["row"]))
+    created = {"clients": 0, "users": 0, "domains": 0}
+    for r in report:
+        if r["status"] == "created":
+            created[r["kind"] + "s"] += 1
+    return {"written": written, "created": created, "errors": errors, "rows": report}
@@ -0,0 +1,251 @@
+# app/services/query_jobs.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from app.utils.responses import dumps
+
+QUERY_JOB_DB_PATH = os.getenv("QUERY_JOB_DB_PATH", "jobs.db")
+# finished results are spooled here as NDJSON files
+QUERY_JOB_DIR = os.getenv("QUERY_JOB_DIR", "job_results")
+# jobs running at once per process; the rest wait as "queued"
+QUERY_JOB_WORKERS = int(os.getenv("QUERY_JOB_WORKERS", "4"))
+# queued + running jobs per client
+QUERY_JOB_PER_CLIENT = int(os.getenv("QUERY_JOB_PER_CLIENT", "2"))
+# finished jobs and their results are deleted after this many seconds
+QUERY_JOB_RETENTION = int(os.getenv("QUERY_JOB_RETENTION", "86400"))
+# an identical job finished less than this long ago is returned instead of running again
+QUERY_JOB_REUSE = int(os.getenv("QUERY_JOB_REUSE", "300"))
+
+# runner(client_id, params, progress, errors) yields lists of result rows;
+# progress(total_delta, done_delta) counts nodes or mailboxes
+Progress = Callable[[int, int], None]
+Runner = Callable[[int, Dict[str, Any], Progress, List[Dict[str, Any]]], AsyncIterator[List[Dict[str, Any]]]]
+
+ACTIVE = ("queued", "running")
+
+
+class JobQuotaExceeded(Exception):
+    pass
+
+
+_local = threading.local()
+_tasks: Dict[str, asyncio.Task] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread, like tracker_store
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(QUERY_JOB_DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def init_jobs():
+    os.makedirs(QUERY_JOB_DIR, exist_ok=True)
+    conn = _conn()
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS query_jobs (
+        id TEXT PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        errors TEXT,
+        error TEXT,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_query_jobs_key ON query_jobs(key, created);
+    CREATE INDEX IF NOT EXISTS idx_query_jobs_client ON query_jobs(client_id, created);
+    """)
+    # jobs of a process that is gone will never finish
+    for r in conn.execute("SELECT id, pid FROM query_jobs WHERE status IN ('queued', 'running')").fetchall():
+        if r["pid"] == os.getpid() or not _alive(r["pid"]):
+            conn.execute("UPDATE query_jobs SET status = 'failed', error = 'interrupted', finished = ? WHERE id = ?",
+                         (time.time(), r["id"]))
+    conn.commit()
+    purge_expired()
+
+
+def result_path(job_id: str) -> str:
+    return os.path.join(QUERY_JOB_DIR, f"{job_id}.ndjson")
+
+def purge_expired():
+    conn = _conn()
+    cutoff = time.time() - QUERY_JOB_RETENTION
+    rows = conn.execute("SELECT id FROM query_jobs WHERE finished < ?", (cutoff,)).fetchall()
+    for r in rows:
+        for path in (result_path(r["id"]), result_path(r["id"]) + ".part"):
+            if os.path.exists(path):
+                os.remove(path)
+    conn.execute("DELETE FROM query_jobs WHERE finished < ?", (cutoff,))
+    conn.commit()
+
+def _public(r: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": r["id"], "kind": r["kind"], "params": json.loads(r["params"]), "status": r["status"],
+        "progress": {"done": r["done"], "total": r["total"]},
+        "count": r["count"], "partial": bool(json.loads(r["errors"] or "[]")),
+        "errors": json.loads(r["errors"] or "[]"), "error": r["error"],
+        "created": r["created"], "started": r["started"], "finished": r["finished"],
+        "expires": r["finished"] + QUERY_JOB_RETENTION if r["finished"] else None,
+    }
+
+def get(job_id: str, client_id: int) -> Optional[Dict[str, Any]]:
+    """
+    The job as shown to its client, or None if it does not exist or belongs to someone else.
+    """
+    r = _conn().execute("SELECT * FROM query_jobs WHERE id = ? AND client_id = ?", (job_id, client_id)).fetchone()
+    return _public(r) if r else None
+
+def list_jobs(client_id: int) -> List[Dict[str, Any]]:
+    purge_expired()
+    rows = _conn().execute("SELECT * FROM query_jobs WHERE client_id = ? ORDER BY created DESC", (client_id,))
+    return [_public(r) for r in rows]
+
+
+def _find_or_create(client_id: int, kind: str, params: Dict[str, Any]) -> Tuple[str, bool]:
+    # runs in a worker thread; BEGIN IMMEDIATE so two processes cannot both create the same job
+    key = f"{client_id}:{kind}:{json.dumps(params, sort_keys=True)}"
+    conn = _conn()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        r = conn.execute("""
+            SELECT id FROM query_jobs
+            WHERE key = ? AND (status IN ('queued', 'running') OR (status = 'done' AND finished >= ?))
+            ORDER BY created DESC LIMIT 1
+        """, (key, now - QUERY_JOB_REUSE)).fetchone()
+        if r is not None:
+            conn.execute("COMMIT")
+            return r["id"], True
+        active = conn.execute("SELECT COUNT(*) FROM query_jobs WHERE client_id = ? AND status IN ('queued', 'running')",
+                              (client_id,)).fetchone()[0]
+        if active >= QUERY_JOB_PER_CLIENT:
+            raise JobQuotaExceeded(f"At most {QUERY_JOB_PER_CLIENT} jobs may be queued or running per client")
+        job_id = uuid.uuid4().hex
+        conn.execute("""
+            INSERT INTO query_jobs (id, client_id, kind, params, key, status, pid, created)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)
+        """, (job_id, client_id, kind, json.dumps(params), key, os.getpid(), now))
+        conn.execute("COMMIT")
+        return job_id, False
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+async def submit(client_id: int, kind: str, params: Dict[str, Any], runner: Runner) -> Tuple[Dict[str, Any], bool]:
+    """
+    Queue a job and return (job, reused). An identical job (same client, kind
+    and params) that is still queued or running, or finished within
+    QUERY_JOB_REUSE seconds, is returned instead of starting another one.
+    Raises JobQuotaExceeded when the client already has QUERY_JOB_PER_CLIENT active jobs.
+    """
+    await asyncio.to_thread(purge_expired)
+    job_id, reused = await asyncio.to_thread(_find_or_create, client_id, kind, params)
+    if not reused:
+        task = asyncio.create_task(_run(job_id, client_id, params, runner))
+        _tasks[job_id] = task
+        task.add_done_callback(lambda _: _tasks.pop(job_id, None))
+    return await asyncio.to_thread(get, job_id, client_id), reused
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancel a job queued or running in this process; False if it is not.
+    """
+    task = _tasks.get(job_id)
+    if task is None:
+        return False
+    task.cancel()
+    return True
+
+
+def _update(job_id: str, **fields):
+    conn = _conn()
+    conn.execute(f"UPDATE query_jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                 (*fields.values(), job_id))
+    conn.commit()
+
+def _job_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(QUERY_JOB_WORKERS)
+    return _semaphore
+
+async def _run(job_id: str, client_id: int, params: Dict[str, Any], runner: Runner):
+    counts = {"done": 0, "total": 0, "flushed": 0.0}
+    errors: List[Dict[str, Any]] = []
+    part = result_path(job_id) + ".part"
+
+    def progress(total: int, done: int):
+        counts["total"] += total
+        counts["done"] += done
+
+    async def flush(force: bool = False):
+        # progress is written at most once a second
+        if force or time.monotonic() - counts["flushed"] >= 1:
+            counts["flushed"] = time.monotonic()
+            await asyncio.to_thread(_update, job_id, done=counts["done"], total=counts["total"])
+
+    try:
+        async with _job_semaphore():
+            await asyncio.to_thread(_update, job_id, status="running", started=time.time())
+            count = 0
+            with open(part, "wb") as f:
+                async for items in runner(client_id, params, progress, errors):
+                    if items:
+                        await asyncio.to_thread(f.write, b"".join(dumps(it) + b"\n" for it in items))
+                        count += len(items)
+                    await flush()
+                f.write(dumps({"_summary": {"count": count, "partial": bool(errors), "errors": errors}}) + b"\n")
+            os.replace(part, result_path(job_id))
+            await flush(force=True)
+            await asyncio.to_thread(_update, job_id, status="done", count=count, errors=json.dumps(errors),
+                                    finished=time.time())
+    except asyncio.CancelledError:
+        _discard(part)
+        await asyncio.shield(asyncio.to_thread(_update, job_id, status="cancelled", finished=time.time()))
+        raise
+    except Exception as e:
+        print(f"Query job {job_id} failed: {e}")
+        _discard(part)
+        await asyncio.to_thread(_update, job_id, status="failed", error=str(e), errors=json.dumps(errors),
+                                finished=time.time())
+
+def _discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def shutdown():
+    """
+    Cancel this process' jobs; called on application shutdown.
+    """
+    tasks = list(_tasks.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,178 @@
+# app/services/spam_cache.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+# a refresh this soon after the last one is served without asking PMG
+SPAM_CACHE_MIN_REFRESH = int(os.getenv("SPAM_CACHE_MIN_REFRESH", "60"))
+# full re-fetch after this long, so released/deleted messages drop out
+SPAM_CACHE_REVALIDATE = int(os.getenv("SPAM_CACHE_REVALIDATE", "600"))
+# incremental slices start this far before the last fetch (clock skew, late delivery)
+SPAM_CACHE_OVERLAP = int(os.getenv("SPAM_CACHE_OVERLAP", "120"))
+SPAM_CACHE_MAX_MESSAGES = int(os.getenv("SPAM_CACHE_MAX_MESSAGES", "200000"))
+
+
+class _Window:
+    """
+    What we know about one key: everything PMG had in [start, end],
+    as of fetched_at (last slice) and validated_at (last full fetch).
+    """
+    __slots__ = ("start", "end", "fetched_at", "validated_at", "data")
+
+    def __init__(self, start: int, end: int, data):
+        now = time.time()
+        self.start, self.end, self.data = start, end, data
+        self.fetched_at = self.validated_at = now
+
+
+class QuarantineCache:
+    """
+    LRU cache of quarantine listings per (host, mailbox) and of spam users
+    per host. A refresh only asks PMG for [last end, now] and merges it in;
+    memory is bounded by SPAM_CACHE_MAX_MESSAGES.
+    """
+
+    def __init__(self, max_messages: int = SPAM_CACHE_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._mailboxes: "OrderedDict[Tuple[str, str], _Window]" = OrderedDict()
+        self._users: Dict[str, _Window] = {}
+        # key -> [lock, holders + waiters]; dropped when the last user leaves
+        self._locks: Dict[Any, list] = {}
+        self._size = 0
+        self.stats = {"hits": 0, "incremental": 0, "full": 0, "evictions": 0, "invalidated": 0}
+
+    @asynccontextmanager
+    async def _lock(self, key) -> AsyncIterator[None]:
+        # one fetcher per key; the lock lives only while someone holds or waits for it
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def _plan(self, w: Optional[_Window], starttime: int, endtime: int) -> Optional[Tuple[int, int, bool]]:
+        """
+        (fetch_start, fetch_end, full) for what PMG still has to send, or None if cached is enough.
+        """
+        now = time.time()
+        if w is None or now - w.validated_at >= SPAM_CACHE_REVALIDATE:
+            return starttime, endtime, True
+        fresh = w.end >= endtime or now - w.fetched_at < SPAM_CACHE_MIN_REFRESH
+        if w.start > starttime:
+            # older than what is cached (paging backwards): extend the window down to starttime
+            return (starttime, w.start, False) if fresh else (starttime, endtime, True)
+        if fresh:
+            return None
+        return max(w.start, w.end - SPAM_CACHE_OVERLAP), endtime, False
+
+    @staticmethod
+    def _extend(w: _Window, start: int, end: int):
+        w.start = min(w.start, start)
+        if end > w.end:
+            w.end, w.fetched_at = end, time.time()
+
+    async def users(self, host: str, starttime: int, endtime: int, fetch) -> Set[str]:
+        """
+        Spam users of host over [starttime, endtime]; fetch(start, end) lists them from PMG.
+        """
+        async with self._lock(("users", host)):
+            w = self._users.get(host)
+            plan = self._plan(w, starttime, endtime)
+            if plan is None:
+                self.stats["hits"] += 1
+                return set(w.data)
+
+            start, end, full = plan
+            fetched = set(await fetch(start, end))
+            if full:
+                self.stats["full"] += 1
+                w = self._users[host] = _Window(start, end, fetched)
+            else:
+                self.stats["incremental"] += 1
+                w.data |= fetched
+                self._extend(w, start, end)
+            return set(w.data)
+
+    async def messages(self, host: str, mailbox: str, starttime: int, endtime: int, fetch) -> List[Dict[str, Any]]:
+        """
+        Messages of host/mailbox in [starttime, endtime]; fetch(start, end) queries PMG.
+        """
+        key = (host, mailbox)
+        async with self._lock(key):
+            w = self._mailboxes.get(key)
+            plan = self._plan(w, starttime, endtime)
+            if plan is None:
+                self.stats["hits"] += 1
+            else:
+                start, end, full = plan
+                fetched = await fetch(start, end)
+                by_id = {str(m.get("id")): m for m in fetched}
+                if full:
+                    self.stats["full"] += 1
+                    if w is not None:
+                        self._size -= len(w.data)
+                    w = _Window(start, end, by_id)
+                else:
+                    self.stats["incremental"] += 1
+                    self._size -= len(w.data)
+                    w.data.update(by_id)
+                    self._extend(w, start, end)
+                self._mailboxes[key] = w
+                self._size += len(w.data)
+                self._evict(keep=key)
+
+            self._mailboxes.move_to_end(key)
+            return [m for m in w.data.values() if starttime <= (m.get("time") or 0) <= endtime]
+
+    def _evict(self, keep):
+        while self._size > self.max_messages and len(self._mailboxes) > 1:
+            key, w = next(iter(self._mailboxes.items()))
+            if key == keep:
+                self._mailboxes.move_to_end(key)
+                continue
+            del self._mailboxes[key]
+            self._size -= len(w.data)
+            self.stats["evictions"] += 1
+
+    async def invalidate(self, host: str, mailbox: Optional[str] = None, ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Forget quarantined messages that were released or deleted: `ids` of
+        host/mailbox, all of that mailbox, or everything cached for host when
+        mailbox is None (the spam user listing too). Returns the messages dropped.
+        """
+        if mailbox is None:
+            self._users.pop(host, None)
+            keys = [k for k in self._mailboxes if k[0] == host]
+        else:
+            keys = [(host, mailbox)]
+        dropped = 0
+        for key in keys:
+            # wait for a fetch in flight so it cannot put the messages back
+            async with self._lock(key):
+                w = self._mailboxes.get(key)
+                if w is None:
+                    continue
+                if ids is None:
+                    del self._mailboxes[key]
+                    gone = len(w.data)
+                else:
+                    gone = sum(w.data.pop(str(i), None) is not None for i in ids)
+                self._size -= gone
+                dropped += gone
+        self.stats["invalidated"] += dropped
+        return dropped
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "mailboxes": len(self._mailboxes), "messages": self._size, "locks": len(self._locks)}
+
+
+cache = QuarantineCache()
@@ -0,0 +1,104 @@
+# app/services/spam_stats.py
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List
+from .domain_matcher import DomainMatcher, domain_of
+
+STATS_DB_PATH = os.getenv("STATS_DB_PATH", "stats.db")
+# granularity of spam_rollup
+SPAM_STATS_BUCKET = int(os.getenv("SPAM_STATS_BUCKET", "3600"))
+# message ids are remembered this long so re-fetched messages are not counted twice
+SPAM_STATS_DEDUPE = int(os.getenv("SPAM_STATS_DEDUPE", str(60 * 86400)))
+
+_local = threading.local()
+_last_purge = 0.0
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread, like tracker_store
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(STATS_DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def init_stats():
+    conn = _conn()
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS spam_seen (
+        host TEXT NOT NULL,
+        id TEXT NOT NULL,
+        time INTEGER NOT NULL,
+        PRIMARY KEY (host, id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_spam_seen_time ON spam_seen(time);
+
+    -- quarantined spam per time bucket, mailbox and (integer) spam score
+    CREATE TABLE IF NOT EXISTS spam_rollup (
+        bucket INTEGER NOT NULL,
+        domain TEXT NOT NULL,
+        mailbox TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (bucket, domain, mailbox, score)
+    );
+    """)
+    conn.commit()
+
+
+def _purge(conn: sqlite3.Connection):
+    global _last_purge
+    if time.time() - _last_purge < 3600:
+        return
+    _last_purge = time.time()
+    conn.execute("DELETE FROM spam_seen WHERE time < ?", (int(time.time()) - SPAM_STATS_DEDUPE,))
+
+def record(host: str, mailbox: str, messages: Iterable[Dict[str, Any]]) -> int:
+    """
+    Count messages fetched from host's quarantine for mailbox into spam_rollup.
+    host should be the cluster's canonical host; messages seen before are skipped.
+    Returns how many were new.
+    """
+    b = SPAM_STATS_BUCKET
+    domain = domain_of(mailbox) or ""
+    conn = _conn()
+    new = 0
+    for m in messages:
+        t = int(m.get("time") or 0)
+        cur = conn.execute("INSERT OR IGNORE INTO spam_seen (host, id, time) VALUES (?, ?, ?)",
+                           (host, str(m.get("id")), t))
+        if cur.rowcount != 1:
+            continue
+        new += 1
+        conn.execute("""
+            INSERT INTO spam_rollup (bucket, domain, mailbox, score, count) VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(bucket, domain, mailbox, score) DO UPDATE SET count = count + 1
+        """, (t // b * b, domain, mailbox, int(m.get("spamlevel") or 0)))
+    _purge(conn)
+    conn.commit()
+    return new
+
+def query(starttime: int, endtime: int, matcher: DomainMatcher) -> List[Dict[str, Any]]:
+    """
+    spam_rollup rows {bucket, domain, mailbox, score, count} for the matcher's domains.
+    Buckets are SPAM_STATS_BUCKET wide and selected by their start.
+    """
+    first = starttime // SPAM_STATS_BUCKET * SPAM_STATS_BUCKET
+    domains = list(matcher.domains)
+    if not domains:
+        return []
+    if matcher.subdomains:
+        cond, args = "1", ()
+    else:
+        cond, args = f"domain IN ({','.join('?' for _ in domains)})", tuple(domains)
+    rows = _conn().execute(f"""
+        SELECT bucket, domain, mailbox, score, count FROM spam_rollup
+        WHERE bucket BETWEEN ? AND ? AND {cond}
+    """, (first, endtime, *args)).fetchall()
+    return [dict(r) for r in rows if not matcher.subdomains or matcher.match_domain(r["domain"])]
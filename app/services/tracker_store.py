@@ -0,0 +1,647 @@
+# app/services/tracker_store.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+from . import pmg_api
+from .domain_matcher import DomainMatcher, domain_of
+from .client_domains import DomainIndex, fingerprint, load_domain_index
+
+TRACKER_DB_PATH = os.getenv("TRACKER_DB_PATH", "tracker.db")
+TRACKER_SYNC_ENABLED = os.getenv("TRACKER_SYNC_ENABLED", "true").lower() in ("true", "1", "yes")
+TRACKER_SYNC_INTERVAL = int(os.getenv("TRACKER_SYNC_INTERVAL", "60"))
+# how far back the first sync of a node goes
+TRACKER_SYNC_BACKFILL = int(os.getenv("TRACKER_SYNC_BACKFILL", str(7 * 86400)))
+# a sync (the first one's backfill in particular) is fetched and stored this many seconds at a time
+TRACKER_SYNC_STEP = int(os.getenv("TRACKER_SYNC_STEP", "86400"))
+# re-read this much before the high-water mark; late status updates are upserted
+TRACKER_SYNC_OVERLAP = int(os.getenv("TRACKER_SYNC_OVERLAP", "300"))
+TRACKER_RETENTION = int(os.getenv("TRACKER_RETENTION", str(30 * 86400)))
+# windows ending at most this far past the high-water mark are still served locally
+TRACKER_MAX_LAG = int(os.getenv("TRACKER_MAX_LAG", "120"))
+# granularity of the mail-flow rollup (tracker_rollup)
+TRACKER_ROLLUP_BUCKET = int(os.getenv("TRACKER_ROLLUP_BUCKET", "3600"))
+# entries re-routed per transaction when a client's partition is rebuilt
+TRACKER_PARTITION_BATCH = int(os.getenv("TRACKER_PARTITION_BATCH", "5000"))
+# message details older than this are final (delivered, bounced or expired) and cached for good
+TRACKER_DETAIL_SETTLE = int(os.getenv("TRACKER_DETAIL_SETTLE", "3600"))
+
+RECEIVING_KEYS = ["to", "recipient", "rcpt_to", "receiver_address"]
+SENDER_KEYS = ["from", "sender", "sender_address"]
+# address fields checked for a client's domains, plus fields that hold a bare domain
+TRACKER_MATCH_KEYS = [
+    "recipient", "to", "receiver", "rcpt_to", "receiver_address",
+    "user", "username", "mailbox", "from", "sender", "sender_address",
+    "receiver_domain", "rcpt_domain", "domain", "maildomain"
+]
+
+_local = threading.local()
+_sync_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+# reverse domain -> client index the sync thread partitions new rows with (see refresh_partitions)
+_index: Optional[DomainIndex] = None
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread: the sync thread writes, request threads read
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(TRACKER_DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def init_store():
+    conn = _conn()
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS tracker_entries (
+        host TEXT NOT NULL,
+        node TEXT NOT NULL,
+        id TEXT NOT NULL,
+        time INTEGER NOT NULL,
+        rcpt_domain TEXT,
+        sender_domain TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (host, node, id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_tracker_time ON tracker_entries(time);
+    CREATE INDEX IF NOT EXISTS idx_tracker_rcpt ON tracker_entries(rcpt_domain, time);
+    CREATE INDEX IF NOT EXISTS idx_tracker_sender ON tracker_entries(sender_domain, time);
+
+    CREATE TABLE IF NOT EXISTS tracker_sync (
+        host TEXT NOT NULL,
+        node TEXT NOT NULL,
+        synced_from INTEGER NOT NULL,
+        high_water INTEGER NOT NULL,
+        last_sync REAL,
+        last_error TEXT,
+        PRIMARY KEY (host, node)
+    );
+
+    CREATE TABLE IF NOT EXISTS tracker_details (
+        host TEXT NOT NULL,
+        node TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (host, node, id)
+    );
+
+    -- entries per time bucket, direction ('in' by rcpt_domain, 'out' by sender_domain) and dstatus;
+    -- kept after the raw entries expire
+    CREATE TABLE IF NOT EXISTS tracker_rollup (
+        bucket INTEGER NOT NULL,
+        host TEXT NOT NULL,
+        node TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (bucket, direction, domain, status, host, node)
+    );
+
+    -- per-client partitions: the entries each client owns (rcpt = 1: on the receiving side)
+    CREATE TABLE IF NOT EXISTS tracker_owners (
+        client_id INTEGER NOT NULL,
+        time INTEGER NOT NULL,
+        host TEXT NOT NULL,
+        node TEXT NOT NULL,
+        id TEXT NOT NULL,
+        rcpt INTEGER NOT NULL,
+        PRIMARY KEY (client_id, time, host, node, id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_tracker_owners_entry ON tracker_owners(host, node, id);
+
+    -- the domain set (client_domains.fingerprint) each client's partition was built for
+    CREATE TABLE IF NOT EXISTS tracker_partitions (
+        client_id INTEGER PRIMARY KEY,
+        domains TEXT NOT NULL,
+        built_at REAL NOT NULL
+    );
+    """)
+    conn.commit()
+    # user_version 1: tracker_rollup covers every stored entry, including those
+    # synced before the rollup existed (later syncs only rebuild the buckets they touch)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+        for r in conn.execute("SELECT host, node, synced_from FROM tracker_sync").fetchall():
+            rollup(r["host"], r["node"], r["synced_from"])
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+
+
+def _domain_of(item: Dict[str, Any], keys: List[str]) -> Optional[str]:
+    for k in keys:
+        v = item.get(k)
+        if v and isinstance(v, str) and "@" in v:
+            return domain_of(v)
+    return None
+
+def _entry_id(item: Dict[str, Any]) -> str:
+    if isinstance(item.get("id"), (str, int)):
+        return str(item["id"])
+    return f"{item.get('from')}_{item.get('to')}_{item.get('time', '')}_{item.get('subject', '')}"
+
+def _owners(index: DomainIndex, item: Dict[str, Any]) -> Dict[int, int]:
+    # client_id -> 1 if the client owns a receiving address, else 0 (sender or other field)
+    out: Dict[int, int] = {}
+    for k in TRACKER_MATCH_KEYS:
+        v = item.get(k)
+        if v and isinstance(v, str):
+            for client_id in index.owners(domain_of(v)):
+                out[client_id] = out.get(client_id, 0) | (k in RECEIVING_KEYS)
+    return out
+
+def _owner_rows(index: DomainIndex, key: Tuple[str, str, str], t: int, item: Dict[str, Any]) -> List[tuple]:
+    return [(client_id, t, *key, rcpt) for client_id, rcpt in _owners(index, item).items()]
+
+def upsert_entries(host: str, node: str, items: Iterable[Dict[str, Any]]) -> int:
+    """
+    Insert tracker rows for host/node; rows already stored are updated in place.
+    Each row is also routed into its owners' partitions (tracker_owners).
+    """
+    rows, keys, owners = [], [], []
+    for it in items:
+        it["_pmg_host"] = host
+        it["_pmg_node"] = node
+        key, t = (host, node, _entry_id(it)), int(it.get("time") or 0)
+        rows.append((*key, t, _domain_of(it, RECEIVING_KEYS), _domain_of(it, SENDER_KEYS), json.dumps(it)))
+        keys.append(key)
+        if _index is not None:
+            owners.extend(_owner_rows(_index, key, t, it))
+
+    conn = _conn()
+    conn.executemany("""
+        INSERT INTO tracker_entries (host, node, id, time, rcpt_domain, sender_domain, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(host, node, id) DO UPDATE SET time = excluded.time, data = excluded.data
+    """, rows)
+    if _index is not None:
+        # a re-synced row may have changed time or receivers: route it afresh
+        conn.executemany("DELETE FROM tracker_owners WHERE host = ? AND node = ? AND id = ?", keys)
+        conn.executemany("INSERT OR IGNORE INTO tracker_owners VALUES (?, ?, ?, ?, ?, ?)", owners)
+    conn.commit()
+    return len(rows)
+
+def refresh_partitions() -> List[int]:
+    """
+    Bring the per-client partitions in line with the domains table: clients
+    whose domain set changed (or that are new) are re-routed over every stored
+    entry, TRACKER_PARTITION_BATCH rows per transaction; removed clients are dropped. The index is then used by
+    upsert_entries for new rows. Returns the rebuilt client ids.
+    """
+    global _index
+    index = load_domain_index()
+    conn = _conn()
+    built = {r["client_id"]: r["domains"] for r in conn.execute("SELECT client_id, domains FROM tracker_partitions")}
+
+    gone = [c for c in built if c not in index.by_client]
+    changed = [c for c in index.clients() if built.get(c) != index.fingerprint(c)]
+    for client_id in gone + changed:
+        conn.execute("DELETE FROM tracker_owners WHERE client_id = ?", (client_id,))
+        conn.execute("DELETE FROM tracker_partitions WHERE client_id = ?", (client_id,))
+    conn.commit()
+
+    if changed:
+        sub = index.only(changed)
+        # one short write transaction per batch, so request threads writing details are not locked out
+        last = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, host, node, id, time, data FROM tracker_entries WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, TRACKER_PARTITION_BATCH)).fetchall()
+            if not rows:
+                break
+            batch = []
+            for r in rows:
+                batch.extend(_owner_rows(sub, (r["host"], r["node"], r["id"]), r["time"], json.loads(r["data"])))
+            conn.executemany("INSERT OR IGNORE INTO tracker_owners VALUES (?, ?, ?, ?, ?, ?)", batch)
+            conn.commit()
+            last = rows[-1]["rowid"]
+        conn.executemany("INSERT INTO tracker_partitions (client_id, domains, built_at) VALUES (?, ?, ?)",
+                         [(c, index.fingerprint(c), time.time()) for c in changed])
+    conn.commit()
+    _index = index
+    return changed
+
+def partition_ready(client_id: int, matcher: DomainMatcher) -> bool:
+    """
+    True if client_id's partition was built for exactly the matcher's domains.
+    Until the next sync picks up a domain change, readers fall back to domain queries.
+    """
+    r = _conn().execute("SELECT domains FROM tracker_partitions WHERE client_id = ?", (client_id,)).fetchone()
+    return r is not None and r["domains"] == fingerprint(matcher.domains, matcher.subdomains)
+
+
+def sync_node(host: str, node: str, via: Optional[str] = None) -> int:
+    """
+    Pull nodes/{node}/tracker from the node's high-water mark up to now, in
+    windows of TRACKER_SYNC_STEP. The high-water mark moves to the end of each
+    window once it has been stored complete, so a failure (e.g. a window PMG
+    can only return truncated) leaves the rest to be fetched by the next sync.
+    Rows are stored under `host`; `via` is the cluster member actually asked (default host).
+    """
+    conn = _conn()
+    now = int(time.time())
+    state = conn.execute(
+        "SELECT synced_from, high_water FROM tracker_sync WHERE host = ? AND node = ?", (host, node)
+    ).fetchone()
+
+    if state is None:
+        synced_from = now - TRACKER_SYNC_BACKFILL
+        start = synced_from
+    else:
+        synced_from = state["synced_from"]
+        start = max(synced_from, state["high_water"] - TRACKER_SYNC_OVERLAP)
+
+    n, stored = 0, False
+    try:
+        lo = start
+        while lo <= now:
+            hi = min(now, lo + TRACKER_SYNC_STEP - 1)
+            items = pmg_api.get_tracker_for_node(via or host, node, params={"starttime": lo, "endtime": hi})
+            n += upsert_entries(host, node, items)
+            conn.execute("""
+                INSERT INTO tracker_sync (host, node, synced_from, high_water, last_sync, last_error)
+                VALUES (?, ?, ?, ?, ?, NULL)
+                ON CONFLICT(host, node) DO UPDATE SET
+                    high_water = excluded.high_water, last_sync = excluded.last_sync, last_error = NULL
+            """, (host, node, synced_from, hi, time.time()))
+            conn.commit()
+            stored = True
+            lo = hi + 1
+    except Exception as e:
+        conn.execute("UPDATE tracker_sync SET last_error = ? WHERE host = ? AND node = ?", (str(e), host, node))
+        conn.commit()
+        raise
+    finally:
+        if stored:
+            rollup(host, node, start)
+    return n
+
+def rollup(host: str, node: str, since: int):
+    """
+    Recompute host/node's tracker_rollup buckets from `since` on. Re-synced rows
+    can change status, so touched buckets are rebuilt rather than incremented.
+    """
+    b = TRACKER_ROLLUP_BUCKET
+    first = since // b * b
+    conn = _conn()
+    conn.execute("DELETE FROM tracker_rollup WHERE host = ? AND node = ? AND bucket >= ?", (host, node, first))
+    for direction, column in (("in", "rcpt_domain"), ("out", "sender_domain")):
+        conn.execute(f"""
+            INSERT INTO tracker_rollup (bucket, host, node, direction, domain, status, count)
+            SELECT time / ? * ?, host, node, ?, {column}, COALESCE(json_extract(data, '$.dstatus'), ''), COUNT(*)
+            FROM tracker_entries
+            WHERE host = ? AND node = ? AND time >= ? AND {column} IS NOT NULL
+            GROUP BY 1, 5, 6
+        """, (b, b, direction, host, node, first))
+    conn.commit()
+
+def purge_expired():
+    cutoff = int(time.time()) - TRACKER_RETENTION
+    conn = _conn()
+    conn.execute("DELETE FROM tracker_entries WHERE time < ?", (cutoff,))
+    conn.execute("DELETE FROM tracker_owners WHERE time < ?", (cutoff,))
+    conn.execute("UPDATE tracker_sync SET synced_from = ? WHERE synced_from < ?", (cutoff, cutoff))
+    conn.commit()
+
+def fold_hosts():
+    """
+    Move rows stored under a host that is not its cluster's canonical host (synced
+    before membership was known, or after a cluster change) onto the canonical host.
+    Rows the canonical host already has win; the rest are dropped as duplicates.
+    """
+    conn = _conn()
+    for host in pmg_api.PMG_HOSTS:
+        canonical = pmg_api.canonical_host(host)
+        if canonical == host or not pmg_api.cluster_map.discovered(host):
+            continue
+        if conn.execute("SELECT 1 FROM tracker_sync WHERE host = ? LIMIT 1", (host,)).fetchone() is None and \
+           conn.execute("SELECT 1 FROM tracker_entries WHERE host = ? LIMIT 1", (host,)).fetchone() is None:
+            continue
+        print(f"Tracker store: folding rows of {host} into {canonical}")
+        for table in ("tracker_entries", "tracker_sync", "tracker_details", "tracker_rollup", "tracker_owners"):
+            conn.execute(f"UPDATE OR IGNORE {table} SET host = ? WHERE host = ?", (canonical, host))
+            conn.execute(f"DELETE FROM {table} WHERE host = ?", (host,))
+        conn.commit()
+        # buckets may now mix both hosts' counts
+        for r in conn.execute("SELECT node, synced_from FROM tracker_sync WHERE host = ?", (canonical,)).fetchall():
+            rollup(canonical, r["node"], r["synced_from"])
+
+def _targets(node_lists: Dict[str, List[str]], failures: Dict[str, str]) -> List[Tuple[str, str, str]]:
+    # (stored host, node, host to ask): each node once per cluster, keyed by the
+    # cluster's first PMG_HOSTS entry so a member failover does not duplicate rows
+    targets, _ = pmg_api.plan_tracker(node_lists, failures, stable=True)
+    return [(pmg_api.canonical_host(via), node, via) for via, node in targets]
+
+def sync_all():
+    try:
+        rebuilt = refresh_partitions()
+        if rebuilt:
+            print(f"Tracker partitions rebuilt for clients {rebuilt}")
+    except Exception as e:
+        print(f"Tracker partition refresh failed: {e}")
+        if _index is None:
+            # new rows cannot be routed: don't let readers trust partitions built earlier
+            _conn().execute("DELETE FROM tracker_partitions")
+            _conn().commit()
+
+    node_lists, failures = {}, {}
+    for host in pmg_api.PMG_HOSTS:
+        if not pmg_api.cluster_map.discovered(host):
+            try:
+                pmg_api.refresh_cluster(host)
+            except Exception as e:
+                # until we know which cluster host belongs to, its rows would be keyed wrongly
+                print(f"Tracker sync: deferring {host}, cluster membership unknown: {e}")
+                failures[host] = f"cluster membership unknown: {e}"
+                continue
+        try:
+            node_lists[host] = pmg_api.get_nodes(host)
+        except Exception as e:
+            print(f"Tracker sync: cannot list nodes on {host}: {e}")
+            failures[host] = str(e)
+
+    if len(failures) < len(pmg_api.PMG_HOSTS):
+        fold_hosts()
+
+    for host, node, via in _targets(node_lists, failures):
+        try:
+            sync_node(host, node, via=via)
+        except Exception as e:
+            print(f"Tracker sync failed for {host}/{node}: {e}")
+    purge_expired()
+
+def _sync_loop():
+    init_store()
+    while not _stop.is_set():
+        try:
+            sync_all()
+        except Exception as e:
+            print("Tracker sync error:", e)
+        _stop.wait(TRACKER_SYNC_INTERVAL)
+
+def start_sync():
+    """
+    Start the background sync thread (no-op if disabled or already running).
+    """
+    global _sync_thread
+    if not TRACKER_SYNC_ENABLED or (_sync_thread and _sync_thread.is_alive()):
+        return
+    _stop.clear()
+    _sync_thread = threading.Thread(target=_sync_loop, name="tracker-sync", daemon=True)
+    _sync_thread.start()
+
+def stop_sync():
+    _stop.set()
+
+
+def covers(starttime: int, endtime: int) -> bool:
+    """
+    True if every known node has been synced over [starttime, endtime].
+    """
+    if not TRACKER_SYNC_ENABLED:
+        return False
+
+    rows = _conn().execute("SELECT host, node, synced_from, high_water FROM tracker_sync").fetchall()
+    state = {(r["host"], r["node"]): r for r in rows}
+
+    node_lists = {}
+    for host in pmg_api.PMG_HOSTS:
+        cached = pmg_api.node_cache.lookup(host)
+        if cached is None:
+            return False
+        node_lists[host] = cached[0]
+
+    for host, node, _ in _targets(node_lists, {}):
+        s = state.get((host, node))
+        if s is None or s["synced_from"] > starttime or s["high_water"] + TRACKER_MAX_LAG < endtime:
+            return False
+    return True
+
+def _placeholders(values) -> str:
+    return ",".join("?" for _ in values)
+
+def query_tracking(starttime: int, endtime: int, matcher: DomainMatcher,
+                   client_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Entries in [starttime, endtime] sent to or from any of the matcher's domains, oldest first.
+    With client_id, the client's partition is read when it is current.
+    """
+    domains = list(matcher.domains)
+    if not domains:
+        return []
+
+    if client_id is not None and partition_ready(client_id, matcher):
+        rows = _conn().execute("""
+            SELECT e.data FROM tracker_owners o
+            JOIN tracker_entries e ON e.host = o.host AND e.node = o.node AND e.id = o.id
+            WHERE o.client_id = ? AND o.time BETWEEN ? AND ?
+        """, (client_id, starttime, endtime)).fetchall()
+    elif matcher.subdomains:
+        # subdomains cannot use the domain indexes: scan the time range instead
+        rows = _conn().execute(
+            "SELECT rcpt_domain, sender_domain, data FROM tracker_entries WHERE time BETWEEN ? AND ?",
+            (starttime, endtime)
+        ).fetchall()
+        rows = [r for r in rows if matcher.match_domain(r["rcpt_domain"]) or matcher.match_domain(r["sender_domain"])]
+    else:
+        ph = _placeholders(domains)
+        rows = _conn().execute(f"""
+            SELECT data FROM tracker_entries
+            WHERE time BETWEEN ? AND ? AND rcpt_domain IN ({ph})
+            UNION
+            SELECT data FROM tracker_entries
+            WHERE time BETWEEN ? AND ? AND sender_domain IN ({ph})
+        """, (starttime, endtime, *domains, starttime, endtime, *domains)).fetchall()
+
+    items = [json.loads(r["data"]) for r in rows]
+    items.sort(key=lambda it: (it.get("time") or 0, it["_pmg_host"], it["_pmg_node"]))
+    return items
+
+def _iter_partition(client_id: int, starttime: int, endtime: int, batch_size: int,
+                    last: tuple) -> Iterator[List[Dict[str, Any]]]:
+    while True:
+        rows = _conn().execute("""
+            SELECT o.time, o.host, o.node, o.id, e.data FROM tracker_owners o
+            JOIN tracker_entries e ON e.host = o.host AND e.node = o.node AND e.id = o.id
+            WHERE o.client_id = ? AND o.time BETWEEN ? AND ? AND (o.time, o.host, o.node, o.id) > (?, ?, ?, ?)
+            ORDER BY o.time, o.host, o.node, o.id
+            LIMIT ?
+        """, (client_id, starttime, endtime, *last, batch_size)).fetchall()
+        if not rows:
+            return
+        last = (rows[-1]["time"], rows[-1]["host"], rows[-1]["node"], rows[-1]["id"])
+        yield [json.loads(r["data"]) for r in rows]
+        if len(rows) < batch_size:
+            return
+
+def iter_tracking(starttime: int, endtime: int, matcher: DomainMatcher, batch_size: int = 1000,
+                  after: Optional[tuple] = None, client_id: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Same rows as query_tracking, yielded in (time, host, node, id) order in
+    batches of batch_size, optionally starting after the position `after`.
+    Each batch is a separate keyset query, so the generator can be resumed
+    from any thread and deep positions cost the same as the first one.
+    """
+    domains = list(matcher.domains)
+    if not domains:
+        return
+    if client_id is not None and partition_ready(client_id, matcher):
+        yield from _iter_partition(client_id, starttime, endtime, batch_size,
+                                   tuple(after) if after else (starttime - 1, "", "", ""))
+        return
+    ph = _placeholders(domains)
+    if matcher.subdomains:
+        cond, args = "1", ()
+    else:
+        cond, args = f"(rcpt_domain IN ({ph}) OR sender_domain IN ({ph}))", (*domains, *domains)
+
+    last = tuple(after) if after else (starttime - 1, "", "", "")
+    while True:
+        rows = _conn().execute(f"""
+            SELECT host, node, id, time, rcpt_domain, sender_domain, data FROM tracker_entries
+            WHERE time BETWEEN ? AND ? AND (time, host, node, id) > (?, ?, ?, ?) AND {cond}
+            ORDER BY time, host, node, id
+            LIMIT ?
+        """, (starttime, endtime, *last, *args, batch_size)).fetchall()
+        if not rows:
+            return
+        last = (rows[-1]["time"], rows[-1]["host"], rows[-1]["node"], rows[-1]["id"])
+        if matcher.subdomains:
+            rows = [r for r in rows if matcher.match_domain(r["rcpt_domain"]) or matcher.match_domain(r["sender_domain"])]
+        yield [json.loads(r["data"]) for r in rows]
+        if len(rows) < batch_size and not matcher.subdomains:
+            return
+
+def page_tracking(starttime: int, endtime: int, matcher: DomainMatcher, page_size: int,
+                  after: Optional[tuple] = None, client_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    One page of query_tracking rows following the position `after`.
+    """
+    page: List[Dict[str, Any]] = []
+    for batch in iter_tracking(starttime, endtime, matcher, batch_size=page_size, after=after, client_id=client_id):
+        page.extend(batch)
+        if len(page) >= page_size:
+            break
+    return page[:page_size]
+
+def query_receiving(starttime: int, endtime: int, matcher: DomainMatcher, match: bool, limit: int,
+                    client_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Newest entries in [starttime, endtime] whose receiving domain is (match=True)
+    or is not (match=False) one of the matcher's domains.
+    With client_id and match=True, the client's partition is read when it is current.
+    """
+    if match and client_id is not None and partition_ready(client_id, matcher):
+        rows = _conn().execute("""
+            SELECT e.data FROM tracker_owners o
+            JOIN tracker_entries e ON e.host = o.host AND e.node = o.node AND e.id = o.id
+            WHERE o.client_id = ? AND o.time BETWEEN ? AND ? AND o.rcpt = 1
+            ORDER BY o.time DESC
+            LIMIT ?
+        """, (client_id, starttime, endtime, limit)).fetchall()
+        return [json.loads(r["data"]) for r in rows]
+
+    if matcher.subdomains:
+        rows = _conn().execute(
+            "SELECT rcpt_domain, data FROM tracker_entries WHERE time BETWEEN ? AND ? ORDER BY time DESC",
+            (starttime, endtime)
+        )
+        out = []
+        for r in rows:
+            if matcher.match_domain(r["rcpt_domain"]) == match:
+                out.append(json.loads(r["data"]))
+                if len(out) >= limit:
+                    break
+        return out
+
+    domains = list(matcher.domains)
+    ph = _placeholders(domains)
+    if match:
+        cond = f"rcpt_domain IN ({ph})"
+    else:
+        cond = f"(rcpt_domain IS NULL OR rcpt_domain NOT IN ({ph}))"
+    rows = _conn().execute(f"""
+        SELECT data FROM tracker_entries
+        WHERE time BETWEEN ? AND ? AND {cond}
+        ORDER BY time DESC
+        LIMIT ?
+    """, (starttime, endtime, *domains, limit)).fetchall()
+    return [json.loads(r["data"]) for r in rows]
+
+def lookup_entries(keys: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+    """
+    Synced tracker rows for (host, node, id) keys; missing keys are left out.
+    host is the cluster's canonical host (pmg_api.canonical_host).
+    """
+    conn = _conn()
+    out = {}
+    for key in keys:
+        r = conn.execute("SELECT data FROM tracker_entries WHERE host = ? AND node = ? AND id = ?", key).fetchone()
+        if r is not None:
+            out[key] = json.loads(r["data"])
+    return out
+
+def get_details(keys: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+    """
+    Cached nodes/{node}/tracker/{id} results for (host, node, id) keys.
+    """
+    conn = _conn()
+    out = {}
+    for key in keys:
+        r = conn.execute("SELECT data FROM tracker_details WHERE host = ? AND node = ? AND id = ?", key).fetchone()
+        if r is not None:
+            out[key] = json.loads(r["data"])
+    return out
+
+def store_details(details: Dict[Tuple[str, str, str], Dict[str, Any]]):
+    """
+    Cache settled message details. They never change, so they are kept without expiry.
+    """
+    if not details:
+        return
+    conn = _conn()
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO tracker_details (host, node, id, data, fetched_at) VALUES (?, ?, ?, ?, ?)",
+        [(*key, json.dumps(d), now) for key, d in details.items()]
+    )
+    conn.commit()
+
+def query_flow(starttime: int, endtime: int, matcher: DomainMatcher, direction: str) -> List[Dict[str, Any]]:
+    """
+    tracker_rollup rows {bucket, domain, status, count} for the matcher's domains,
+    summed over hosts/nodes. Buckets are TRACKER_ROLLUP_BUCKET wide and selected by their start.
+    """
+    first = starttime // TRACKER_ROLLUP_BUCKET * TRACKER_ROLLUP_BUCKET
+    domains = list(matcher.domains)
+    if not domains:
+        return []
+    if matcher.subdomains:
+        cond, args = "1", ()
+    else:
+        cond, args = f"domain IN ({_placeholders(domains)})", tuple(domains)
+    rows = _conn().execute(f"""
+        SELECT bucket, domain, status, SUM(count) AS count FROM tracker_rollup
+        WHERE direction = ? AND bucket BETWEEN ? AND ? AND {cond}
+        GROUP BY bucket, domain, status
+    """, (direction, first, endtime, *args)).fetchall()
+    return [dict(r) for r in rows if not matcher.subdomains or matcher.match_domain(r["domain"])]
+
+def sync_status() -> List[Dict[str, Any]]:
+    rows = _conn().execute("SELECT * FROM tracker_sync ORDER BY host, node").fetchall()
+    return [dict(r) for r in rows]
+
+def partition_status() -> List[Dict[str, Any]]:
+    rows = _conn().execute("""
+        SELECT p.client_id, p.built_at, (SELECT COUNT(*) FROM tracker_owners o WHERE o.client_id = p.client_id) AS entries
+        FROM tracker_partitions p ORDER BY p.client_id
+    """).fetchall()
+    return [dict(r) for r in rows]
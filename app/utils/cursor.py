@@ -0,0 +1,32 @@
+import base64
+import json
+from typing import Any, Optional, Tuple
+from fastapi import HTTPException
+from app.services.pmg_api import canonical_host
+
+# a position in a merged result: (time, host, node, id)
+Position = Tuple[int, str, str, str]
+
+
+def encode_cursor(pos: Position) -> str:
+    raw = json.dumps(list(pos), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Position]:
+    """
+    Parse an opaque cursor from a previous page; 400 if it was tampered with.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        t, host, node, id_ = json.loads(raw)
+        return int(t), str(host), str(node), str(id_)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def position(item: Any, node_key: str = "_pmg_node") -> Position:
+    # keyed by the cluster's canonical host: the member that answered can differ between pages
+    host = item.get("_pmg_host")
+    return (int(item.get("time") or 0), canonical_host(host) if host else "", item.get(node_key) or "",
+            str(item.get("id", "")))
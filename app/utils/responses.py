@@ -0,0 +1,40 @@
+import json
+from typing import Any, Dict, Optional
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# orjson is optional; fall back to the stdlib encoder
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _fallback(obj: Any) -> Any:
+    # only values the encoder does not know natively take the jsonable_encoder path
+    return jsonable_encoder(obj)
+
+def dumps(content: Any) -> bytes:
+    """
+    Compact UTF-8 JSON. PMG payloads are plain dicts/lists/str/int, which need no conversion.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=_fallback, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_fallback, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with dumps().
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> FastJSONResponse:
+    """
+    Return this from an endpoint to skip FastAPI's jsonable_encoder walk over the payload.
+    """
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
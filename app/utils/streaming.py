@@ -0,0 +1,55 @@
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from app.utils.responses import dumps
+
+NDJSON = "application/x-ndjson"
+
+# (host, node, items, error) as produced by pmg_async.iter_tracker_batches
+Batch = Tuple[Optional[str], Optional[str], List[Dict[str, Any]], Optional[str]]
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+def ndjson_response(batches: AsyncIterator[Batch],
+                    keep: Callable[[Dict[str, Any]], bool],
+                    uid: Callable[[Dict[str, Any]], Any],
+                    limit: Optional[int] = None) -> StreamingResponse:
+    """
+    Stream items as one JSON object per line while batches arrive; each batch is
+    filtered with keep() and deduped on uid(). A last line {"_summary": {...}}
+    carries the item count and per-node errors.
+    """
+    async def body():
+        seen = set()
+        count = 0
+        errors = []
+        async for host, node, items, error in batches:
+            if error is not None:
+                err = {"host": host, "error": error}
+                if node is not None:
+                    err["node"] = node
+                errors.append(err)
+                continue
+
+            lines = []
+            for it in items:
+                if not keep(it):
+                    continue
+                key = uid(it)
+                if key in seen:
+                    continue
+                seen.add(key)
+                lines.append(dumps(it))
+                count += 1
+                if limit and count >= limit:
+                    break
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+            if limit and count >= limit:
+                break
+
+        yield dumps({"_summary": {"count": count, "partial": bool(errors), "errors": errors}}) + b"\n"
+
+    return StreamingResponse(body(), media_type=NDJSON)
@@ -0,0 +1,77 @@
+"""
+Encode time and bytes on the wire for /pmg/tracking and /spam_quarantine/spam-quarantine
+style payloads: FastAPI's default path (jsonable_encoder + JSONResponse) against
+FastJSONResponse, and identity against gzip / brotli.
+
+    python benchmarks/bench_responses.py [rows]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.utils.responses import FastJSONResponse, ORJSON_AVAILABLE
+from app.utils.compression import _Encoder, BROTLI_AVAILABLE
+
+
+def tracker_payload(n: int) -> dict:
+    now = int(time.time())
+    items = []
+    for i in range(n):
+        items.append({
+            "id": f"C{i:08X}R{random.randint(0, 9)}", "time": now - i * 7,
+            "from": f"sender{i % 500}@example-{i % 40}.com", "to": f"user{i % 300}@client{i % 20}.com",
+            "subject": f"Invoice {i} for account {i % 77}", "dstatus": random.choice("ABDNQ"),
+            "msgid": f"<{i}.{now}@mx.example.com>", "client": f"10.0.{i % 255}.{i % 200}",
+            "_pmg_host": f"pmg{i % 3}.example.net", "_pmg_node": f"node{i % 6}",
+        })
+    return {"count": n, "items": items, "partial": False, "errors": []}
+
+def spam_payload(n: int) -> dict:
+    now = int(time.time())
+    items = []
+    for i in range(n):
+        items.append({
+            "id": f"C{i % 4}R{i}T{now}", "time": now - i * 13, "bytes": 2000 + i % 9000,
+            "from": f"spam{i % 900}@bulk-{i % 50}.biz", "receiver": f"user{i % 300}@client{i % 20}.com",
+            "envelope_sender": f"bounce{i}@bulk-{i % 50}.biz", "subject": f"You have won {i} prizes",
+            "spamlevel": i % 30, "_pmg_host": f"pmg{i % 3}.example.net", "_pmg_email": f"user{i % 300}@client{i % 20}.com",
+        })
+    return {"count": n, "items": items, "partial": False, "errors": []}
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def bench(name: str, payload: dict):
+    default = lambda: JSONResponse(jsonable_encoder(payload)).body
+    fast = lambda: FastJSONResponse(payload).body
+
+    t_default, t_fast = best_of(default), best_of(fast)
+    body = fast()
+    print(f"{name}: {payload['count']} rows")
+    print(f"  encode  default {t_default * 1000:8.1f} ms   fast {t_fast * 1000:8.1f} ms   ({t_default / t_fast:.1f}x)")
+
+    sizes = [("identity", len(body), 0.0)]
+    for encoding in ("gzip", "br") if BROTLI_AVAILABLE else ("gzip",):
+        t = best_of(lambda: _Encoder(encoding).compress(body, final=True), repeat=3)
+        sizes.append((encoding, len(_Encoder(encoding).compress(body, final=True)), t))
+    for encoding, size, t in sizes:
+        print(f"  {encoding:8} {size / 1024:10.1f} KiB  {size / len(body):6.1%}  +{t * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(1)
+    print(f"orjson: {ORJSON_AVAILABLE}  brotli: {BROTLI_AVAILABLE}")
+    bench("/pmg/tracking", tracker_payload(rows))
+    bench("/spam_quarantine/spam-quarantine", spam_payload(rows))
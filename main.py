@@ -1,23 +1,44 @@
 from fastapi import FastAPI
-from app.db import init_db
-from app.routers import admin, clients, auth
-from app.routers import tracker, domains, domain_filter, spam_quarantine, spam_content
+from app.db import init_db, pool
+from app.routers import admin, clients, auth, bulk, jobs
+from app.routers import tracker, domains, domain_filter, spam_quarantine, spam_content, stats
+from app.services import pmg_api, pmg_async, pmg_health, tracker_store, spam_stats, provisioning, query_jobs
+from app.utils.responses import FastJSONResponse
+from app.utils.compression import CompressionMiddleware
 from dotenv import load_dotenv
-import os
 
 load_dotenv()  # this reads .env and sets env vars
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+app.add_middleware(CompressionMiddleware)
 
 @app.on_event("startup")
 def startup_event():
     init_db()
+    pmg_api.warm_node_cache()
+    pmg_health.start_probe(pmg_api.probe)
+    tracker_store.init_store()
+    spam_stats.init_stats()
+    query_jobs.init_jobs()
+    tracker_store.start_sync()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    tracker_store.stop_sync()
+    await query_jobs.shutdown()
+    pmg_health.stop_probe()
+    pool.close_all()
+    provisioning.shutdown()
+    await pmg_async.close_all()
 
 app.include_router(admin.router, prefix="/admin")
 app.include_router(clients.router, prefix="/clients")
 app.include_router(auth.router, prefix="/auth")
+app.include_router(bulk.router, prefix="/bulk", tags=["bulk"])
 app.include_router(tracker.router, prefix="/pmg", tags=["pmg"])
 app.include_router(domains.router, prefix="/domains", tags=["domains"])
 app.include_router(domain_filter.router, prefix="/domain_filter", tags=["domain_filter"])
 app.include_router(spam_quarantine.router, prefix="/spam_quarantine", tags=["spam_quarantine"])
-app.include_router(spam_content.router, prefix="/spam_content", tags=["spam_content"])
\ No newline at end of file
+app.include_router(spam_content.router, prefix="/spam_content", tags=["spam_content"])
+app.include_router(stats.router, prefix="/stats", tags=["stats"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
\ No newline at end of file